@@ -0,0 +1,224 @@
+from collections import defaultdict
+import threading
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+#variable types and solver statuses shared by all backends (the values are those of Gurobi)
+BINARY      = 'B'
+INTEGER     = 'I'
+OPTIMAL     = 2
+INFEASIBLE  = 3
+TIME_LIMIT  = 9
+INTERRUPTED = 11
+
+#callback events
+MIPSOL      = 'mipsol' #a new incumbent was found, whose values are given by cb_values
+MIP         = 'mip'    #periodically during branch and bound
+
+environments = threading.local() #the started Gurobi environment of every thread, shared by its models (and of every process, as it cannot be forked)
+
+
+class Var_Dict(dict):
+    #the part of gurobipy.tupledict used by the encoders: sum(*pattern) adds up the variables whose index matches pattern, where '*' matches anything
+
+    def __init__(self, variables, quicksum):
+        super(Var_Dict, self).__init__(variables)
+        self.quicksum = quicksum
+        self.buckets  = dict() #for every wildcard mask, the variables grouped by the non-wildcard positions of their indexes
+
+    def sum(self, *pattern):
+        if len(pattern) == 0:
+            return self.quicksum(list(self.values()))
+        mask = tuple(map(lambda x : x == '*', pattern))
+        if mask not in self.buckets:
+            buckets = defaultdict(list)
+            for index,var in self.items():
+                index = index if isinstance(index, tuple) else (index,)
+                buckets[tuple(x for x,wildcard in zip(index,mask) if not wildcard)].append(var)
+            self.buckets[mask] = buckets
+        return self.quicksum(self.buckets[mask].get(tuple(x for x in pattern if x != '*'), []))
+
+
+class Gurobi_Backend:
+
+    name       = "gurobi"
+    quadratic  = True #supports (convex) quadratic objectives with integer variables
+    lazy       = True #supports lazy constraints added from callbacks
+    progress   = True #supports the MIP event and cb_progress
+
+    def __init__(self, model_name, timeout, threads):
+        import gurobipy as gp
+        self.gp    = gp
+        self.model = gp.Model(model_name, env=Gurobi_Backend.environment())
+        if not self.model:
+            logger.error("FATAL, could not create Gurobi model")
+            exit(0)
+        self.model.setParam('TimeLimit', timeout)
+        self.model.setParam('Threads'  , threads)
+        self.callbacks = []
+        self.where     = None
+
+    @staticmethod
+    def environment():
+        #starting an environment checks the license, so it is done once per thread and process, and the parameters are set on every model instead
+        if getattr(environments, 'pid', None) != os.getpid():
+            import gurobipy as gp
+            env = gp.Env(empty=True)
+            env.setParam('OutputFlag'   , 0)
+            env.setParam('LogToConsole' , 0)
+            env.start()
+            environments.env, environments.pid = env, os.getpid()
+        return environments.env
+
+    def add_vars(self, indexes, vtype, lb=0, ub=None, name=''):
+        return self.model.addVars(indexes, vtype=vtype, lb=lb, ub=ub if ub != None else self.gp.GRB.INFINITY, name=name)
+
+    def add_constr(self, constr, name=''):
+        return self.model.addConstr(constr, name)
+
+    def quicksum(self, terms):
+        return self.gp.quicksum(terms)
+
+    def set_objective(self, expr):
+        self.model.setObjective(expr, self.gp.GRB.MINIMIZE)
+
+    def add_callback(self, event, function, lazy=False):
+        #function() is called during optimize at every event, and can add lazy constraints with cb_lazy if lazy is True
+        self.callbacks.append((event, function))
+        if lazy:
+            self.model.setParam('LazyConstraints', 1)
+
+    def dispatch(self, model, where):
+        events     = { self.gp.GRB.Callback.MIPSOL : MIPSOL, self.gp.GRB.Callback.MIP : MIP }
+        self.where = where
+        for event,function in self.callbacks:
+            if events.get(where) == event:
+                function()
+
+    def optimize(self):
+        if len(self.callbacks) == 0:
+            self.model.optimize()
+        else:
+            self.model.optimize(self.dispatch)
+
+    def values(self, variables) -> list:
+        return self.model.getAttr('X', variables)
+
+    def value(self, expr):
+        return expr.getValue()
+
+    def cb_values(self, variables) -> list:
+        return self.model.cbGetSolution(variables)
+
+    def cb_lazy(self, constr):
+        self.model.cbLazy(constr)
+
+    def cb_progress(self) -> tuple:
+        #(seconds, incumbent objective or None, best bound or None, explored nodes) from a MIP or MIPSOL callback
+        cb = self.gp.GRB.Callback
+        if self.where == cb.MIPSOL:
+            incumbent, bound, nodes = self.model.cbGet(cb.MIPSOL_OBJBST), self.model.cbGet(cb.MIPSOL_OBJBND), self.model.cbGet(cb.MIPSOL_NODCNT)
+        else:
+            incumbent, bound, nodes = self.model.cbGet(cb.MIP_OBJBST)   , self.model.cbGet(cb.MIP_OBJBND)   , self.model.cbGet(cb.MIP_NODCNT)
+        infinity = self.gp.GRB.INFINITY #no incumbent or no bound yet (the bound is -1e+100 until the root relaxation is solved)
+        return self.model.cbGet(cb.RUNTIME), incumbent if abs(incumbent) < infinity else None, bound if abs(bound) < infinity else None, nodes
+
+    def terminate(self):
+        self.model.terminate()
+
+    @property
+    def status(self):     return self.model.status
+    @property
+    def sol_count(self):  return self.model.SolCount
+    @property
+    def obj_val(self):    return self.model.ObjVal
+    @property
+    def obj_bound(self):  return self.model.ObjBound
+    @property
+    def mip_gap(self):    return self.model.MIPGap
+    @property
+    def runtime(self):    return self.model.Runtime
+    @property
+    def node_count(self): return self.model.NodeCount
+
+
+class HiGHS_Backend:
+
+    name       = "highs"
+    quadratic  = False #HiGHS solves quadratic objectives only for continuous variables
+    lazy       = False
+    progress   = False
+
+    def __init__(self, model_name, timeout, threads):
+        import highspy
+        self.highspy = highspy
+        self.model   = highspy.Highs()
+        self.model.silent()
+        self.model.setOptionValue('time_limit', float(timeout))
+        self.model.setOptionValue('threads'   ,       threads )
+        self.model_name = model_name
+
+    def add_vars(self, indexes, vtype, lb=0, ub=None, name=''):
+        if vtype == BINARY:
+            lb,ub = 0,1
+        variables = self.model.addVariables(indexes, lb=lb, ub=ub if ub != None else self.model.inf, type=self.highspy.HighsVarType.kInteger, name_prefix=name)
+        return Var_Dict(variables, self.quicksum)
+
+    def add_constr(self, constr, name=''):
+        return self.model.addConstr(constr, name=name) if name else self.model.addConstr(constr)
+
+    def quicksum(self, terms):
+        return self.model.qsum(terms)
+
+    def set_objective(self, expr):
+        self.model.setObjective(expr, sense=self.highspy.ObjSense.kMinimize)
+
+    def optimize(self):
+        self.model.run()
+
+    def values(self, variables) -> list:
+        return list(self.model.vals(variables))
+
+    def value(self, expr):
+        return self.model.val(expr)
+
+    def terminate(self):
+        self.model.cancelSolve()
+
+    @property
+    def status(self):
+        status = self.model.getModelStatus()
+        statuses = { self.highspy.HighsModelStatus.kOptimal    : OPTIMAL,
+                     self.highspy.HighsModelStatus.kInfeasible : INFEASIBLE,
+                     self.highspy.HighsModelStatus.kTimeLimit  : TIME_LIMIT,
+                     self.highspy.HighsModelStatus.kInterrupt  : INTERRUPTED }
+        return statuses.get(status, self.model.modelStatusToString(status))
+    @property
+    def sol_count(self):  return 1 if self.model.getInfo().primal_solution_status == 2 else 0 #2 is kSolutionStatusFeasible
+    @property
+    def obj_val(self):    return self.model.getInfo().objective_function_value
+    @property
+    def obj_bound(self):  return self.model.getInfo().mip_dual_bound
+    @property
+    def mip_gap(self):    return self.model.getInfo().mip_gap
+    @property
+    def runtime(self):    return self.model.getRunTime()
+    @property
+    def node_count(self): return self.model.getInfo().mip_node_count
+
+
+BACKENDS = { Gurobi_Backend.name : Gurobi_Backend, HiGHS_Backend.name : HiGHS_Backend }
+
+
+def warm(backend : str):
+    #prepares the current thread to create models of backend without delay
+    if backend == Gurobi_Backend.name:
+        Gurobi_Backend.environment()
+
+
+def create(backend : str, model_name : str, timeout, threads):
+    if backend not in BACKENDS:
+        raise ValueError("Unknown solver backend '{}', must be one of {}".format(backend, ", ".join(BACKENDS)))
+    return BACKENDS[backend](model_name, timeout, threads)
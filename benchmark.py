@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import backends
+import safety
+import utils
+import ilp
+
+ENCODERS = { 'robust' : ilp.Encode_Robust, 'leastsquares' : ilp.Encode_LeastSquares }
+
+#the usages of the startup benchmark, run in fresh interpreters on the graphs of INPUT, and the heavy modules whose loading it reports
+STARTUP  = { 'safety' : "import utils, safety\nfor G in utils.read_graphs(INPUT, width=False): safety.maximal_safe_sequences_via_dominators(G, set(G.edge_list))",
+             'width'  : "import utils, safety\nfor G in utils.read_graphs(INPUT): safety.maximal_safe_sequences_via_dominators(G, set(G.edge_list))",
+             'ilp'    : "import ilp",
+             'main'   : "import main" }
+HEAVY    = ['gurobipy','highspy','networkx','numpy','graphviz']
+
+
+def instances(args):
+    #yields the graphs of the input file on which the ILPs are defined, together with the safe sequences of a weighted edge antichain and the other
+    #safe sequences
+    for G in utils.read_graphs(args.input):
+        if len(G.edge_list)==0 or utils.is_0_flow_everywhere(G):
+            continue
+        safe_seqs = safety.maximal_safe_sequences_via_dominators(G, set(G.edge_list))
+        P2F       = utils.sequences_to_fix(G, safe_seqs)
+        yield G, P2F, utils.sequences_to_imply(safe_seqs, P2F)
+
+
+def print_row(row):
+    print(" ".join(map(lambda x : "{:>12}".format('%.4f' % x if isinstance(x,float) else str(x)), row)))
+
+
+def random_subpaths(G, paths, count, seed):
+    #count subpath constraints of 1 to 4 arcs drawn from the given decomposition paths, so that the ILP with as many paths stays feasible
+    rng  = random.Random(seed)
+    arcs = [ list(zip([G.source] + path, path + [G.sink])) for path in paths ]
+    R    = []
+    for _ in range(count):
+        path   = rng.choice(arcs)
+        length = rng.randint(1, min(4, len(path)))
+        start  = rng.randint(0, len(path)-length)
+        R.append(path[start:start+length])
+    return R
+
+
+def compare(args, configs):
+    #solves every graph once per configuration (keyword arguments of the encoder, 'safe' to override -s, 'subpaths' for a number of random subpath
+    #constraints, and 'implied' to add the safe sequences not fixed as subpath constraints), reporting the status, running time and explored nodes of
+    #each solve
+    print_row(['graph','n','m','w'] + [ x + '-' + label for label in configs for x in ['status','time','nodes'] ])
+    totals = { label : [0.0, 0] for label in configs }
+    for G,P2F,implied in instances(args):
+        row = [G.id, G.n, G.m, G.w]
+        paths = None
+        for label,config in configs.items():
+            kwargs   = dict(config)
+            safe     = kwargs.pop('safe', args.safe)
+            subpaths = kwargs.pop('subpaths', 0)
+            R        = implied if kwargs.pop('implied', False) else []
+            kwargs.setdefault('backend', args.solver)
+            if subpaths > 0 and paths == None: #the subpaths are drawn from a decomposition into k=w paths, without subpath constraints
+                paths = ENCODERS[args.formulation](G.n, G.edge_list, G.source, G.sink, G.flow, G.w, [], [], args.epsilon, args.timeout, args.threads, backend=args.solver).solve_once().solution.paths
+            R       = random_subpaths(G, paths, subpaths, G.id) if subpaths > 0 else R
+            encoder = ENCODERS[args.formulation](G.n, G.edge_list, G.source, G.sink, G.flow, G.w, R, P2F if safe else [], args.epsilon, args.timeout, args.threads, **kwargs)
+            encoder.encode()
+            encoder.solve()
+            row += [encoder.model.status, encoder.model.runtime, int(encoder.model.node_count)]
+            totals[label][0] += encoder.model.runtime
+            totals[label][1] += int(encoder.model.node_count)
+        print_row(row)
+    print_row(['total','','',''] + [ x for label in configs for x in [''] + totals[label] ])
+
+
+def bench_bigm(args):
+    compare(args, { 'global' : dict(), 'tight' : dict(tight_bounds=True) })
+
+
+def bench_symmetry(args):
+    compare(args, { 'none' : dict(), 'weights' : dict(symmetry='weights'), 'source' : dict(symmetry='source') })
+
+
+def bench_backends(args):
+    configs = dict()
+    for backend in backends.BACKENDS:
+        configs[backend]           = dict(backend=backend, safe=False)
+        configs[backend + '-safe'] = dict(backend=backend, safe=True )
+    compare(args, configs)
+
+
+def bench_unitigs(args):
+    compare(args, { 'arcs' : dict(), 'unitigs' : dict(unitigs=True) })
+
+
+def bench_lazy(args):
+    configs = dict()
+    for count in map(int, args.subpaths.split(',')):
+        configs['eager-' + str(count)] = dict(subpaths=count)
+        configs['lazy-'  + str(count)] = dict(subpaths=count, lazy=True)
+    compare(args, configs)
+
+
+def bench_implied(args):
+    compare(args, { 'fixed' : dict(safe=True), 'implied' : dict(safe=True, implied=True), 'lazy' : dict(safe=True, implied=True, lazy=True) })
+
+
+def bench_batch(args):
+    #wall-clock time to solve the graphs selected by -x one by one and in batches, including the creation of the solver models, and the number of
+    #graphs whose objectives differ
+    selected = [ (G, P2F if args.safe else []) for G,P2F,implied in instances(args) if ilp.batchable(G, *args.batch) ]
+    single   = []
+    start    = time.time()
+    for G,P2F in selected:
+        try:
+            single.append( getattr(ilp, args.formulation)(G, args.epsilon, args.timeout, args.threads, vars_to_fix=P2F, backend=args.solver).obj )
+        except (utils.GRB_TimeOut, utils.GRB_Infeasible):
+            single.append( None )
+    t_single = time.time() - start
+
+    start    = time.time()
+    results  = getattr(ilp, args.formulation + '_batch')([ G for G,P2F in selected ], args.epsilon, args.timeout, args.threads, [ P2F for G,P2F in selected ], backend=args.solver)
+    t_batch  = time.time() - start
+    batch    = [ result.obj if isinstance(result, ilp.ILP_Result) else None for result in results ]
+
+    print_row(['graphs','single','batch','differ'])
+    print_row([len(selected), t_single, t_batch, sum( a != b for a,b in zip(single, batch) )])
+
+
+def bench_forced(args):
+    #wall-clock time of the graphs solved without a solver model, against solving their ILP
+    print_row(['graph','n','m','w','obj-forced','time-forced','obj-ilp','time-ilp'])
+    totals = [0, 0, 0.0, 0.0]
+    for G,P2F,implied in instances(args):
+        totals[0] += 1
+        P2F        = P2F if args.safe else []
+        start      = time.perf_counter()
+        forced     = ilp.forced_result(ENCODERS[args.formulation], G, [], P2F, False)
+        t_forced   = time.perf_counter() - start
+        if forced == None:
+            continue
+        start      = time.perf_counter()
+        result     = ENCODERS[args.formulation](G.n, G.edge_list, G.source, G.sink, G.flow, G.w, [], P2F, args.epsilon, args.timeout, args.threads, backend=args.solver).solve_once()
+        t_ilp      = time.perf_counter() - start
+        totals[1:] = [totals[1]+1, totals[2]+t_forced, totals[3]+t_ilp]
+        print_row([G.id, G.n, G.m, G.w, forced.obj, t_forced, result.obj, t_ilp])
+    print_row(['total', totals[0], 'forced', totals[1], '', totals[2], '', totals[3]])
+
+
+def bench_timeline(args):
+    #seconds to the first incumbent and until the gap falls below 10% and 1%, without and with fixing the safe sequences, from the solver timeline
+    def reached(timeline, gap):
+        return next( (seconds for solve,k,seconds,incumbent,bound,g,nodes in timeline if g != None and g <= gap), None )
+
+    configs = ['vanilla','safe']
+    print_row(['graph','n','m','w'] + [ x + '-' + label for label in configs for x in ['first','gap10','gap1','time'] ])
+    for G,P2F,implied in instances(args):
+        row = [G.id, G.n, G.m, G.w]
+        for label in configs:
+            encoder = ENCODERS[args.formulation](G.n, G.edge_list, G.source, G.sink, G.flow, G.w, [], P2F if label == 'safe' else [], args.epsilon, args.timeout, args.threads, backend=args.solver, timeline=True)
+            try:
+                result = encoder.solve_once()
+            except (utils.GRB_TimeOut, utils.GRB_Infeasible):
+                row += [None, None, None, encoder.runtime]
+                continue
+            row += [result.first_feasible(), reached(result.timeline, 0.1), reached(result.timeline, 0.01), encoder.runtime]
+        print_row(row)
+
+
+def bench_search(args):
+    #optimizes the number of paths of every graph with each search strategy, reporting the final k, the number of ILP solves and the solver time
+    strategies = ['linear','galloping','greedy','speculative']
+    print_row(['graph','n','m','w'] + [ x + '-' + strategy for strategy in strategies for x in ['k','solves','time'] ])
+    totals = { strategy : [0, 0.0] for strategy in strategies }
+    for G,P2F,implied in instances(args):
+        row = [G.id, G.n, G.m, G.w]
+        for strategy in strategies:
+            encoder = ENCODERS[args.formulation](G.n, G.edge_list, G.source, G.sink, G.flow, G.w, [], P2F if args.safe else [], args.epsilon, args.timeout, args.threads, backend=args.solver)
+            result  = encoder.optimize(strategy, args.workers)
+            row    += [result.k, result.solves, encoder.runtime]
+            totals[strategy][0] += result.solves
+            totals[strategy][1] += encoder.runtime
+        print_row(row)
+    print_row(['total','','',''] + [ x for strategy in strategies for x in [''] + totals[strategy] ])
+
+
+def bench_startup(args):
+    #cold-start time of every usage in STARTUP, as the median over -n fresh interpreters of the wall-clock time of the whole process and of the time
+    #spent in the usage itself, with the heavy modules it loaded
+    directory = os.path.dirname(os.path.abspath(__file__))
+    print_row(['usage','process','usage','modules'])
+    for usage,code in STARTUP.items():
+        program = "import time, sys, json\nINPUT = {!r}\nstart = time.perf_counter()\n{}\nprint(json.dumps([time.perf_counter()-start, [ m for m in {!r} if m in sys.modules ]]))".format(os.path.abspath(args.input), code, HEAVY)
+        runs    = []
+        for _ in range(args.repeats):
+            start        = time.perf_counter()
+            output       = subprocess.run([sys.executable, "-c", program], cwd=directory, capture_output=True, text=True, check=True).stdout
+            inner,loaded = json.loads(output.splitlines()[-1])
+            runs.append((time.perf_counter()-start, inner))
+        print_row([usage, statistics.median(map(lambda run : run[0], runs)), statistics.median(map(lambda run : run[1], runs)), ",".join(loaded) if loaded else '-'])
+
+
+BENCHMARKS = { 'bigm' : bench_bigm, 'symmetry' : bench_symmetry, 'backends' : bench_backends, 'search' : bench_search, 'unitigs' : bench_unitigs, 'lazy' : bench_lazy, 'implied' : bench_implied, 'batch' : bench_batch, 'forced' : bench_forced, 'timeline' : bench_timeline, 'startup' : bench_startup }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark ILP variants.')
+
+    parser.add_argument('-i', '--input'      , required=True                                , help='Input file path'                                  )
+    parser.add_argument('-b', '--bench'      , required=True, choices=list(BENCHMARKS)      , help='Benchmark to run'                                 )
+    parser.add_argument('-f', '--formulation', choices=list(ENCODERS), default='robust'     , help='ILP formulation (default: robust)'                )
+    parser.add_argument('-s', '--safe'       , action='store_true'                          , help='Fix the safe sequences of a weighted edge antichain')
+    parser.add_argument('-l', '--solver'     , choices=list(backends.BACKENDS), default='gurobi', help='MILP solver backend (default: gurobi)'         )
+    parser.add_argument('-t', '--threads'    , type=int  , default=4                        , help='Number of threads (default: 4)'                   )
+    parser.add_argument('-g', '--timeout'    , type=int  , default=300                      , help='Timeout in seconds (default: 300)'                )
+    parser.add_argument('-e', '--epsilon'    , type=float, default=0.25                     , help='Relative optima improvement (default: 0.25)'      )
+    parser.add_argument('-p', '--workers'    , type=int  , default=2                        , help='Parallel solves of the speculative search (default: 2)')
+    parser.add_argument('-r', '--subpaths'   , default='10,100,1000'                        , help='Comma-separated numbers of random subpath constraints of the lazy benchmark (default: 10,100,1000)')
+    parser.add_argument('-n', '--repeats'    , type=int  , default=5                        , help='Fresh interpreters timed by the startup benchmark (default: 5)')
+    parser.add_argument('-x', '--batch'      , type=int, nargs=2, default=[50,3], metavar=('ARCS','WIDTH'), help='Largest graphs of the batch benchmark (default: 50 3)')
+
+    args = parser.parse_args()
+
+    BENCHMARKS[args.bench](args)
+
+
+if __name__ == "__main__":
+    main()
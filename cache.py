@@ -0,0 +1,169 @@
+import collections
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import copy
+import graph
+import ilp
+
+logger = logging.getLogger(__name__)
+FORMS  = 1024 #canonical forms kept in memory, which a graph needs for every lookup and store
+
+
+def canonical_labels(G : graph.st_DAG) -> list:
+    #Relabels the vertices by the shape of the graph around them: every vertex is colored by a digest of the multiset of (color, flow) of its in-arcs,
+    #in topological order, and by another one of its out-arcs, in reverse topological order, the source and the sink being told apart. Vertices are
+    #numbered by color, so that isomorphic graphs get the same labels up to ties among equally colored vertices, which are broken by their original
+    #order (and can only cost a cache miss). Each pass costs O(m log m), while refining a partition to its fixed point can take n rounds
+    order,_ = ilp.topological_order(G.n, G.edge_list)
+    marker  = lambda v : b"s" if v == G.source else b"t" if v == G.sink else b"v"
+    digest  = lambda v, arcs : hashlib.blake2b(marker(v) + b"".join(sorted( color + str(flow).encode() for color,flow in arcs )), digest_size=16).digest()
+    forward = [None] * G.n
+    for v in order:
+        forward[v]  = digest(v, [ (forward[u] , G.flow[(u,v)]) for u in G.in_neighbors (v) ])
+    backward = [None] * G.n
+    for v in reversed(order):
+        backward[v] = digest(v, [ (backward[w], G.flow[(v,w)]) for w in G.out_neighbors(v) ])
+    order = sorted(range(G.n), key=lambda v : (forward[v], backward[v], v))
+    label = [None] * G.n
+    for i,v in enumerate(order):
+        label[v] = i
+    return label
+
+
+def relabel_arcs(sequences : list, label) -> list:
+    return [ [ (label[u],label[v]) for (u,v) in sequence ] for sequence in sequences ]
+
+
+def relabel_result(result : ilp.ILP_Result, label) -> ilp.ILP_Result:
+    result = copy.deepcopy(result)
+    if result.solution != None:
+        result.solution.paths = [ [ label[v] for v in path ] for path in result.solution.paths ]
+    return result
+
+
+class Result_Cache:
+    #Persistent cache of the results computed on every graph, stored as one file per entry in directory. Entries are keyed by a hash of the canonically
+    #relabeled arcs and flows of the graph together with the parameters of the computation, so that isomorphic graphs share them, and are stored in the
+    #canonical labels. The least recently used entries are evicted when the files exceed max_bytes, down to 90% of it. The sizes and the order of use of
+    #the entries are kept in memory, so that a store costs O(1), and the directory is scanned again only to evict, as other processes may have stored
+    #or used entries since
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.forms     = collections.OrderedDict() #arcs and flows -> (digest, label, inverse label) of the last FORMS graphs
+        self.hits      = 0
+        self.misses    = 0
+        self.lock      = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.entries, self.size = self.scan()
+
+    def form(self, G : graph.st_DAG):
+        #keyed by the content of G rather than by G itself, so that the graphs are not kept alive by a long-running process (see service.py)
+        key = (G.n, tuple( (u, v, G.flow[(u,v)]) for (u,v) in G.edge_list ))
+        with self.lock:
+            if key in self.forms:
+                self.forms.move_to_end(key)
+                return self.forms[key]
+        label   = canonical_labels(G)
+        arcs    = sorted( (label[u], label[v], G.flow[(u,v)]) for (u,v) in G.edge_list )
+        digest  = hashlib.sha256(repr((G.n, arcs)).encode()).hexdigest()
+        inverse = [None] * G.n
+        for v,l in enumerate(label):
+            inverse[l] = v
+        with self.lock:
+            self.forms[key] = (digest, label, inverse)
+            while len(self.forms) > FORMS:
+                self.forms.popitem(last=False)
+        return digest, label, inverse
+
+    def path(self, G, kind, parameters):
+        digest,_,_ = self.form(G)
+        key        = hashlib.sha256(repr((digest, kind, parameters)).encode()).hexdigest()
+        return os.path.join(self.directory, key + ".pkl")
+
+    def load(self, path):
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path) #the modification time orders the entries for eviction, also for the other processes
+            with self.lock:
+                if os.path.basename(path) in self.entries:
+                    self.entries.move_to_end(os.path.basename(path))
+            self.hits += 1
+            return value
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+
+    def store(self, path, value):
+        temporary = path + ".{}.{}.tmp".format(os.getpid(), threading.get_ident())
+        with open(temporary, "wb") as f:
+            pickle.dump(value, f)
+        os.replace(temporary, path)
+        name  = os.path.basename(path)
+        bytes = os.path.getsize(path)
+        with self.lock:
+            self.size         += bytes - self.entries.pop(name, 0)
+            self.entries[name] = bytes
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def scan(self) -> tuple:
+        #(entry -> bytes from the least to the most recently used, total bytes) of the files in the directory
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                    entries.append((stat.st_mtime, stat.st_size, name))
+                except OSError: #removed by another process
+                    pass
+        entries = collections.OrderedDict( (name,bytes) for mtime,bytes,name in sorted(entries) )
+        return entries, sum(entries.values())
+
+    def evict(self):
+        self.entries, self.size = self.scan()
+        while self.size > 0.9 * self.max_bytes and len(self.entries) > 0:
+            name,bytes = self.entries.popitem(last=False)
+            try:
+                os.remove(os.path.join(self.directory, name))
+                logger.debug("Evicted cache entry %s", name)
+            except OSError:
+                pass
+            self.size -= bytes
+
+    def get_width(self, G):
+        return self.load(self.path(G, "width", None))
+
+    def put_width(self, G, width):
+        self.store(self.path(G, "width", None), width)
+
+    def get_safety(self, G, kind):
+        #(safe sequences, sequences to fix, seconds) of the safety computation kind on G
+        value = self.load(self.path(G, kind, None))
+        if value == None:
+            return None
+        _,_,inverse = self.form(G)
+        safe_seqs, sequences_to_fix, seconds = value
+        return relabel_arcs(safe_seqs, inverse), relabel_arcs(sequences_to_fix, inverse), seconds
+
+    def put_safety(self, G, kind, safe_seqs, sequences_to_fix, seconds):
+        _,label,_ = self.form(G)
+        self.store(self.path(G, kind, None), (relabel_arcs(safe_seqs, label), relabel_arcs(sequences_to_fix, label), seconds))
+
+    def get_result(self, G, parameters, fixed):
+        #(ILP_Result, seconds) of the ILP solved on G with the given parameters and fixed safe sequences
+        _,label,inverse = self.form(G)
+        value = self.load(self.path(G, "ilp", (parameters, relabel_arcs(fixed, label))))
+        if value == None:
+            return None
+        result, seconds = value
+        return relabel_result(result, inverse), seconds
+
+    def put_result(self, G, parameters, fixed, result, seconds):
+        _,label,_ = self.form(G)
+        self.store(self.path(G, "ilp", (parameters, relabel_arcs(fixed, label))), (relabel_result(result, label), seconds))
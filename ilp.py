@@ -1,30 +1,704 @@
-from gurobipy import GRB
-import gurobipy as gp
+import backends
 import logging
+import multiprocessing
+import multiprocessing.connection
 import graph
+import stages
 import utils
 
 logger    = logging.getLogger(__name__)
-TOLERANCE = 0.1  #tolerance allowed for Gurobi numerical values
+TOLERANCE = 0.1  #tolerance allowed for solver numerical values
+watcher   = None #the jobs.Job_Watcher of the job run by this process, told about every model solved and its progress samples
+
+def topological_order(n, E):
+    out_arcs  = [[] for _ in range(n)]
+    in_degree = [0] * n
+    for (u,v) in E:
+        out_arcs[u].append(v)
+        in_degree[v] += 1
+
+    order = [ v for v in range(n) if in_degree[v]==0 ]
+    for u in order:
+        for v in out_arcs[u]:
+            in_degree[v] -= 1
+            if in_degree[v] == 0:
+                order.append(v)
+
+    return order, out_arcs
+
+
+def arc_upper_bounds(n, E, F) -> dict:
+    #If a path has a weight larger than every flow value on its arcs, decreasing its weight by one reduces the error on all of its arcs, so some optimal
+    #solution has every path weight bounded by the largest flow value on that path. The weight of a path using (u,v) is thus bounded by the largest flow
+    #value on any source-to-sink path through (u,v), i.e., max(up[u], f(u,v), down[v]) below. The bound is at least 1, the lower bound of the weights.
+    order, out_arcs = topological_order(n, E)
+
+    up   = [0] * n #largest flow value on some arc of a path from the source to v
+    down = [0] * n #largest flow value on some arc of a path from u to the sink
+    for u in order:
+        for v in out_arcs[u]:
+            up[v] = max(up[v], up[u], F[(u,v)])
+    for u in reversed(order):
+        for v in out_arcs[u]:
+            down[u] = max(down[u], down[v], F[(u,v)])
+
+    return { (u,v) : max(1, up[u], F[(u,v)], down[v]) for (u,v) in E }
+
+
+def greedy_width(n, E, F, source, sink) -> int:
+    #number of paths removed by the greedy-width heuristic, which repeatedly subtracts a source-to-sink path of maximum bottleneck from the flow values.
+    #Every iteration zeroes at least one arc, so there are at most m of them
+    order, out_arcs = topological_order(n, E)
+    remaining       = dict(F)
+    paths           = 0
+
+    while True:
+        width         = [0]    * n
+        parent        = [None] * n
+        width[source] = utils.inf
+        for u in order:
+            for v in out_arcs[u]:
+                bottleneck = min(width[u], remaining[(u,v)])
+                if bottleneck > width[v]:
+                    width[v]  = bottleneck
+                    parent[v] = u
+
+        if width[sink] <= 0:
+            return paths
+
+        v = sink
+        while v != source:
+            remaining[(parent[v],v)] -= width[sink]
+            v = parent[v]
+        paths += 1
+
+
+def relative_gap(incumbent, bound):
+    #the MIP gap as Gurobi defines it, |incumbent-bound|/|incumbent|
+    if incumbent == None or bound == None:
+        return None
+    if incumbent == 0:
+        return 0.0 if bound == 0 else float('inf')
+    return abs(incumbent-bound)/abs(incumbent)
+
+
+def drop_implied_subpaths(R, P2F) -> list:
+    #a subpath constraint whose arcs all belong to a safe sequence is satisfied by the path fixed to that sequence, so it needs no encoding
+    fixed = list(map(set, P2F))
+    kept  = [ subpath for subpath in R if not any( set(subpath) <= arcs for arcs in fixed ) ]
+    if len(kept) < len(R):
+        logger.info("Dropped %d of %d subpath constraints implied by the safe sequences", len(R)-len(kept), len(R))
+    return kept
+
+
+class Unitig_Contraction:
+    #Contracts every unitig (maximal path whose inner vertices have a unique in-neighbor and a unique out-neighbor) into a single arc, since a path
+    #using one arc of a unitig uses all of them. The vertices left are renumbered keeping the source first and the sink last, as the encoders expect.
+    #Two unitigs with the same endpoints would become parallel arcs, so in that case the last inner vertex of the second one is kept.
+
+    def __init__(self, n, E, F, source, sink):
+        in_degree  = [0] * n
+        out_degree = [0] * n
+        out_arcs   = [[] for _ in range(n)]
+        for (u,v) in E:
+            out_degree[u] += 1
+            in_degree [v] += 1
+            out_arcs  [u].append(v)
+        inner = lambda v : v != source and v != sink and in_degree[v] == 1 and out_degree[v] == 1
+
+        chains = []
+        for (u,v) in E:
+            if inner(u):
+                continue
+            chain = [(u,v)]
+            while inner(chain[-1][1]):
+                x = chain[-1][1]
+                chain.append((x,out_arcs[x][0]))
+            chains.append(chain)
+
+        contracted = dict() #(first vertex, last vertex) of a contracted arc -> original arcs
+        for chain in sorted(chains, key=len): #single arcs first, as they cannot be split
+            u,v = chain[0][0], chain[-1][1]
+            if (u,v) in contracted:
+                contracted[(u,chain[-1][0])] = chain[:-1]
+                contracted[(chain[-1][0],v)] = chain[-1:]
+            else:
+                contracted[(u,v)] = chain
+
+        kept         = sorted(set(x for arc in contracted for x in arc) | set([source, sink]))
+        self.vertex  = kept                                       #original vertex of every contracted vertex
+        label        = { v : i for i,v in enumerate(kept) }
+        self.n       = len(kept)
+        self.source  = label[source]
+        self.sink    = label[sink]
+        self.chains  = { (label[u],label[v]) : chain for (u,v),chain in contracted.items() }
+        position     = { arc : i for i,arc in enumerate(E) }
+        self.E       = sorted(self.chains, key=lambda e : position[self.chains[e][0]]) #in the order of the first original arcs
+        self.flows   = { e : [ F[arc] for arc in self.chains[e] ] for e in self.E }
+        self.F       = { e : max(self.flows[e]) for e in self.E }
+        self.arc_of  = { arc : e for e,chain in self.chains.items() for arc in chain }
+
+    def arcs(self, path) -> list:
+        #the contracted arcs covering a list of original arcs
+        arcs = []
+        for arc in path:
+            if len(arcs) == 0 or arcs[-1] != self.arc_of[arc]:
+                arcs.append(self.arc_of[arc])
+        return arcs
+
+    def expand(self, path) -> list:
+        #the original inner vertices of a path given by its contracted inner vertices
+        vertices = [self.source] + path + [self.sink]
+        expanded = []
+        for u,v in zip(vertices, vertices[1:]):
+            expanded += [ y for (x,y) in self.chains[(u,v)] ]
+        return expanded[:-1]
+
+
+def st_chains(n, E, source, sink) -> list:
+    #the arcs of every source-to-sink chain if the graph consists of internally vertex-disjoint such chains (width 1 being the simplest case), or None
+    in_degree = [0] * n
+    out_arcs  = [[] for _ in range(n)]
+    for (u,v) in E:
+        in_degree[v] += 1
+        out_arcs [u].append(v)
+
+    chains = []
+    for v in out_arcs[source]:
+        chain = [(source,v)]
+        while v != sink:
+            if in_degree[v] != 1 or len(out_arcs[v]) != 1:
+                return None
+            chain.append((v,out_arcs[v][0]))
+            v = out_arcs[v][0]
+        chains.append(chain)
+    return chains if sum(map(len, chains)) == len(E) else None
+
+
+def forced_result(encoder, G : graph.st_DAG, R, P2F, optimize, epsilon=0.25):
+    #Solves without creating a solver model the instances whose paths are known up to how many of them run along each of some arc-disjoint groups of
+    #arcs, so that every group can be optimized on its own (encoder.path_optimum). These are the graphs made of source-to-sink chains, where the paths
+    #are spread over the chains by dynamic programming (for every k tried by optimize_linear, if optimize is True), and, for a single k, the instances
+    #whose safe sequences are arc-disjoint source-to-sink paths. Returns the optimal ILP_Result, or None if the instance is not of these kinds.
+    complete = lambda P : len(P) > 0 and P[0][0] == G.source and P[-1][1] == G.sink and all( P[j][1] == P[j+1][0] for j in range(len(P)-1) )
+    chains   = st_chains(G.n, G.edge_list, G.source, G.sink)
+    if chains != None:
+        lb = [ 0 ] * len(chains) #paths needed on every chain by the safe sequences and the subpath constraints
+        ub = None
+        for P in P2F:
+            c = next(( c for c,chain in enumerate(chains) if set(P) <= set(chain) ), None)
+            if c == None:
+                return None
+            lb[c] += 1
+        for subpath in R:
+            c = next(( c for c,chain in enumerate(chains) if set(subpath) <= set(chain) ), None)
+            if c == None:
+                return None
+            lb[c] = max(lb[c], 1)
+    elif not optimize and len(P2F) == G.w and all(map(complete, P2F)) and len(set().union(*map(set, P2F))) == sum(map(len, P2F)):
+        covered = set().union(*map(set, P2F))
+        chains  = [ list(P) for P in P2F ] + [ [ e for e in G.edge_list if e not in covered ] ] #the arcs of no path form the last group
+        lb      = [ 1 ] * len(P2F) + [ 0 ]
+        ub      = [ 1 ] * len(P2F) + [ 0 ]
+        if not all( any( set(subpath) <= set(P) for P in P2F ) for subpath in R ):
+            return None
+    else:
+        return None
+
+    flows = [ [ G.flow[e] for e in chain ] for chain in chains ]
+    def decompose(k): #minimum objective over the numbers of paths on every chain adding up to k, with those numbers
+        best = { 0 : (0, []) }
+        for c in range(len(chains)):
+            step = dict()
+            for used,(obj,counts) in best.items():
+                for paths in range(lb[c], (k-used if ub == None else ub[c]) + 1):
+                    optimum = encoder.path_optimum(flows[c], paths)
+                    if optimum != None and (used+paths not in step or obj+optimum[1] < step[used+paths][0]):
+                        step[used+paths] = (obj+optimum[1], counts + [paths])
+            best = step
+        return best.get(k, (None, None))
+
+    k          = G.w
+    obj,counts = decompose(k)
+    if obj == None:
+        return None
+    while optimize and obj > 0: #the stopping rule of optimize_linear
+        next_obj,next_counts = decompose(k+1)
+        if next_obj == None or next_obj >= obj:
+            break
+        if next_obj == 0 or 1-next_obj/obj >= epsilon:
+            k,obj,counts = k+1,next_obj,next_counts
+            continue
+        break
+
+    #every chain gets its paths, all of weight 1 and slack 0 but the first one, which takes the rest of the weight and the slack of the chain; the
+    #chains of the safe sequences come first, in the order of their layers
+    paths, weights, slacks = [], [], []
+    for c in range(len(chains)):
+        if counts[c] > 0:
+            weight,_,slack = encoder.path_optimum(flows[c], counts[c])
+            paths   += [ [ v for (u,v) in chains[c][:-1] ] ] * counts[c]
+            weights += [ weight-counts[c]+1 ] + [ 1 ] * (counts[c]-1)
+            slacks  += [ slack ] + [ 0 ] * (counts[c]-1)
+    order = []
+    for P in P2F:
+        order.append(next( i for i in range(len(paths)) if i not in order and set(P) <= set(zip([G.source] + paths[i], paths[i] + [G.sink])) ))
+    order += [ i for i in range(len(paths)) if i not in order ]
+    solution = Decomposition([ paths[i] for i in order ], [ weights[i] for i in order ], [ slacks[i] for i in order ] if encoder.name == "Robust" else None)
+    logger.info("Found the optimal decomposition of graph %s into %d paths without solving", G.id, k)
+    return ILP_Result(backends.OPTIMAL, k, obj, obj, 0, 0, solution, 0)
+
+
+class Decomposition:
+
+    def __init__(self, paths, weights, slacks=None):
+        self.paths   = paths   #paths[i] is the list of inner vertices of the i-th path (the source and the sink are omitted)
+        self.weights = weights
+        self.slacks  = slacks  #None for LeastSquares
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self): #(weight, path) or (weight, slack, path) tuples
+        if self.slacks == None:
+            return iter(zip(self.weights, self.paths))
+        return iter(zip(self.weights, self.slacks, self.paths))
+
+    def __str__(self):
+        return str(list(self))
+
+
+class ILP_Result:
+
+    def __init__(self, status, k, obj, bound, gap, runtime, solution, solves=1, timeline=None):
+        self.status   = status   #backends.OPTIMAL, or backends.TIME_LIMIT if the time limit was hit before proving optimality (solution is then the best incumbent)
+        self.k        = k
+        self.obj      = obj
+        self.bound    = bound
+        self.gap      = gap
+        self.runtime  = runtime  #cumulative solver running time of all the solves leading to this result
+        self.solution = solution #Decomposition built by the encoder
+        self.solves   = solves   #number of ILPs solved to obtain this result
+        self.timeline = timeline #(solve, k, seconds, incumbent, bound, gap, nodes) samples of all the solves, if they were recorded
+
+    def first_feasible(self):
+        #seconds from the start of the first solve to its first incumbent, if the timeline was recorded
+        if self.timeline == None:
+            return None
+        return next( (seconds for solve,k,seconds,incumbent,bound,gap,nodes in self.timeline if solve == 0 and incumbent != None), None )
+
+    def is_optimal(self) -> bool:
+        return self.status == backends.OPTIMAL
+
+    def __str__(self):
+        return "status={} k={} obj={} bound={} gap={} runtime={} solves={}".format(self.status, self.k, self.obj, self.bound, self.gap, self.runtime, self.solves)
+
+
+class Encode_MFD:
+
+    name = "MFD"
+
+    @stages.timed("solve")
+    def solve(self):
+        if watcher != None:
+            watcher.started(self.model)
+            try:
+                self.model.optimize()
+            finally:
+                watcher.finished(self.model)
+        else:
+            self.model.optimize()
+        if self.timeline != None: #the final state, also for the backends without progress callbacks
+            solved = self.model.status in [backends.OPTIMAL, backends.TIME_LIMIT]
+            self.add_sample(self.model.runtime, self.model.obj_val if self.has_solution() else None, self.model.obj_bound if solved else None, self.model.node_count, final=True)
+        self.runtime += self.model.runtime
+        self.solves  += 1
+        if self.lazy and self.R!=[]:
+            logger.info("Added %d of %d subpath constraints lazily", len(self.separated), len(self.R))
+
+    def contract(self, n, E, source, sink, F, R, P2F, unitigs):
+        #returns the instance to encode, which is the unitig-contracted one if unitigs is True
+        self.original    = (n, E, source, sink, F, R, P2F)
+        self.contraction = Unitig_Contraction(n, E, F, source, sink) if unitigs else None
+        if self.contraction == None:
+            return n, E, source, sink, F, R, P2F, { e : [F[e]] for e in E }
+        c = self.contraction
+        logger.info("Contracted %d arcs into %d unitigs", len(E), len(c.E))
+        return c.n, c.E, c.source, c.sink, c.F, list(map(c.arcs, R)), list(map(c.arcs, P2F)), c.flows
+
+    def weight_ub(self,i):
+        return self.path_ub[i] if i < len(self.path_ub) else self.w_max
+
+    def separate_subpath_constraints(self):
+        #Callback of the lazy mode, called at every new incumbent: the subpath constraints not covered by any of its paths get their spc_vars
+        #constraints, as EncodeSubpathConstraints would have added them. The solver may discard lazy constraints, so they are added again whenever
+        #an incumbent violates them
+        values = self.model.cb_values(list(self.edge_vars.values()))
+        used   = [ set() for _ in range(self.k) ]
+        for index,x in enumerate(values):
+            if x > 1-TOLERANCE:
+                i,a = divmod(index, self.m)
+                used[i].add(self.E[a])
+
+        for j,subpath in enumerate(self.R):
+            if any( used[i].issuperset(subpath) for i in range(self.k) ):
+                continue
+            for i in range(self.k):
+                self.model.cb_lazy( self.model.quicksum( self.edge_vars[u,v,i] for (u,v) in subpath ) >= len(subpath) * self.spc_vars[i,j] )
+            self.model.cb_lazy( self.spc_vars.sum('*',j) >= 1 )
+            self.separated.add(j)
+
+    def add_sample(self, seconds, incumbent, bound, nodes, final=False):
+        last = self.timeline[-1] if len(self.timeline) > 0 else None
+        if not final and last != None and last[0] == self.solves and last[3:5] == (incumbent, bound):
+            return
+        self.timeline.append( (self.solves, self.k, seconds, incumbent, bound, relative_gap(incumbent, bound), nodes) )
+        if watcher != None:
+            watcher.progress(self.timeline[-1])
+
+    def record_progress(self):
+        #Callback of the timeline mode, sampling the progress of the solve whenever its incumbent or best bound changes
+        self.add_sample(*self.model.cb_progress())
+
+    def has_solution(self) -> bool:
+        return self.model.sol_count > 0
+
+    @stages.timed("extract")
+    def build_solution(self) -> Decomposition:
+        #edge_vars holds the arcs of self.E in order for each layer, so the value at position i*m+a belongs to arc E[a] in layer i
+        values = self.model.values(list(self.edge_vars.values()))
+        succ   = [ [None] * self.n for _ in range(self.k) ]
+        for index,x in enumerate(values):
+            if x > 1-TOLERANCE:
+                i,a = divmod(index, self.m)
+                u,v = self.E[a]
+                succ[i][u] = v
 
-def tail(grb_edge): return int(grb_edge.split("[")[1].split(",")[0])
-def head(grb_edge): return int(grb_edge.split("[")[1].split(",")[1])
+        paths = []
+        for i in range(self.k):
+            path = []
+            u    = succ[i][self.source]
+            while u != self.target:
+                path.append(u)
+                u = succ[i][u]
+            paths.append(path if self.contraction == None else self.contraction.expand(path))
+
+        weights = list(map(round, self.model.values(list(self.weights.values()))))
+        return Decomposition(paths, weights)
 
+    def result(self) -> ILP_Result:
+        return ILP_Result(self.model.status, self.k, self.model.obj_val, self.model.obj_bound, self.model.mip_gap, self.runtime, self.build_solution(), self.solves, self.timeline)
 
-class Encode_LeastSquares:
+    def block_result(self, runtime) -> ILP_Result:
+        #the result of this encoder when it is one of the disjoint blocks of a batch model: the objective is its own part of the batch objective, and an
+        #optimal batch is optimal in every block since the blocks share no variables
+        obj = self.model.value(self.objective)
+        if self.model.status == backends.OPTIMAL:
+            return ILP_Result(self.model.status, self.k, obj, obj , 0   , runtime, self.build_solution())
+        return     ILP_Result(self.model.status, self.k, obj, None, None, runtime, self.build_solution())
+
+    def solve_once(self):
+        logger.info(">>> Solving once")
+        self.encode()
+        self.solve()
+        logger.info("Solver status " + str(self.model.status))
+        if self.model.status == backends.TIME_LIMIT and not self.has_solution():
+            raise utils.GRB_TimeOut("ilp.{}.solve_once while finding feasible solution".format(self.name))
+        elif self.model.status == backends.INFEASIBLE:
+            raise utils.GRB_Infeasible("ilp.{}.solve_once while finding feasible solution".format(self.name))
+        elif self.model.status in [backends.OPTIMAL, backends.TIME_LIMIT]:
+            return self.result()
+        else:
+            logger.error("FATAL: solver finished with status " + str(self.model.status) + ", which is not: OPT, TIME_LIMIT, INFEASIBLE.")
+
+    def optimize_linear(self):
+        #Assumption: the initial value of self.k is sufficiently high so that the ILP solver starts with a feasible solution
+
+        self.encode()
+        self.solve()
+        if self.model.status == backends.TIME_LIMIT:
+            self.final_k = self.k
+            if self.has_solution():
+                return self.result()
+            raise utils.GRB_TimeOut("ilp.{}.optimize_linear in the feasibility stage of the optimization loop".format(self.name))
+        elif self.model.status == backends.INFEASIBLE:
+            self.final_k = self.k
+            raise utils.GRB_Infeasible("ilp.{}.optimize_linear in the feasibility stage of the optimization loop".format(self.name))
+        previous = self.result()
+
+        if previous.obj == 0:
+            logger.info(">>> No optimization step required, found perfect solution in init solving with " + str(self.k))
+            self.final_k = self.k
+            return previous
+
+        self.clear()
+        self.k += 1
+
+        logger.info(">>> Optimality, starting with " + str(self.k))
+        while True: #optimality criteria: find the k for which the ratio of objectives between two consecutive iterations becomes sufficiently small
+
+            self.encode()
+            self.solve()
+            logger.info("Solver status " + str(self.model.status))
+
+            if self.model.status == backends.TIME_LIMIT: #we cannot decide whether k paths improve enough, so we return the best decomposition found so far
+                logger.info(">>> Time limit while optimizing with " + str(self.k))
+                if self.has_solution() and self.model.obj_val < previous.obj:
+                    self.final_k = self.k
+                    return self.result()
+                self.final_k     = self.k-1
+                previous.status  = backends.TIME_LIMIT
+                previous.runtime = self.runtime
+                return previous
+            elif self.model.status == backends.INFEASIBLE:
+                self.final_k = self.k-1
+                raise utils.GRB_Infeasible("ilp.{}.optimize_linear while optimizing".format(self.name))
+            #assert(self.model.obj_val <= previous.obj) not necessarily true, as the lower bound of the weight variables is 1
+
+            if self.model.obj_val >= previous.obj: #if we do not improve by allowing more paths we stop
+                self.final_k = self.k-1
+                break
+
+            if self.model.obj_val==0: #if we found a perfect solution we stop
+                self.final_k = self.k
+                previous     = self.result()
+                break
 
-    def __init__(self,n,E,source,sink,F,edge_width,R,P2F,epsilon,timeout,threads):
+            assert(previous.obj != 0)
+
+            if 1-self.model.obj_val/previous.obj < self.epsilon: # if the relative improvement is small we also stop
+                self.final_k = self.k-1
+                break
+
+            previous = self.result()
+            self.clear()
+            self.k += 1
+
+        previous.runtime = self.runtime
+        return previous
+
+    def solve_k(self, k) -> ILP_Result:
+        if self.solves > 0:
+            self.clear()
+        self.k = k
+        self.encode()
+        self.solve()
+        logger.info("Solver status " + str(self.model.status) + " with k=" + str(k))
+        if self.model.status == backends.TIME_LIMIT and not self.has_solution():
+            raise utils.GRB_TimeOut("ilp.{}.solve_k while finding feasible solution with k={}".format(self.name, k))
+        elif self.model.status == backends.INFEASIBLE:
+            raise utils.GRB_Infeasible("ilp.{}.solve_k while finding feasible solution with k={}".format(self.name, k))
+        return self.result()
+
+    def optimize_galloping(self, start):
+        #Finds the same k as optimize_linear, that is, the smallest k (not smaller than the initial one) for which stops(k) holds, assuming that stops is
+        #monotone in k. From start, we probe k at exponentially increasing distances, upwards if stops(start) fails and downwards otherwise, and then
+        #bisect the interval between the last k that failed and the first k that held.
+        k0      = self.k
+        results = dict()
+
+        class Interrupted(Exception):
+            pass
+
+        def objective(k):
+            if k not in results:
+                results[k] = self.solve_k(k)
+                if not results[k].is_optimal():
+                    raise Interrupted()
+            return results[k].obj
+
+        def stops(k):
+            return objective(k) == 0 or objective(k+1) >= objective(k) or 1-objective(k+1)/objective(k) < self.epsilon
+
+        try:
+            lo,hi = k0-1, max(k0,start) #stops(lo) fails (k0-1 acts as a sentinel) and stops(hi) holds
+            step  = 1
+            if stops(hi):
+                while hi > k0:
+                    probe = max(k0, hi-step)
+                    if not stops(probe):
+                        lo = probe
+                        break
+                    hi    = probe
+                    step *= 2
+            else:
+                lo = hi
+                while not stops(lo+step):
+                    lo    = lo+step
+                    step *= 2
+                hi = lo+step
+
+            while hi-lo > 1:
+                mid = (lo+hi)//2
+                if stops(mid):
+                    hi = mid
+                else:
+                    lo = mid
+
+        except (Interrupted, utils.GRB_TimeOut) as e: #we return the best decomposition found so far
+            logger.info(">>> Time limit while optimizing with " + str(self.k))
+            solved = [ result for result in results.values() if result.is_optimal() ]
+            if len(solved) == 0:
+                if self.k not in results:
+                    raise e
+                self.final_k = self.k
+                return results[self.k]
+            best = min(solved, key=lambda result : (result.obj, result.k))
+            best.status  = backends.TIME_LIMIT
+            best.runtime = self.runtime
+            self.final_k = best.k
+            return best
+
+        self.final_k        = hi
+        results[hi].runtime = self.runtime
+        return results[hi]
+
+    def arguments(self, threads) -> tuple:
+        #the constructor arguments of this encoder, to build a copy of it in another process
+        n, E, source, sink, F, R, P2F = self.original
+        return (n, E, source, sink, F, self.k, R, P2F, self.epsilon, self.timeout, threads, self.tight, self.symmetry, self.backend, self.contraction != None, self.lazy, self.timeline != None)
+
+    def optimize_speculative(self, workers):
+        #Finds the same k as optimize_linear, but solves k, k+1, ..., k+workers-1 at the same time in separate processes, each with an equal share
+        #of the threads. As soon as the stopping rule has decided the final k, the solves still running are terminated.
+        k0      = self.k
+        threads = max(1, self.threads//workers)
+        context = multiprocessing.get_context('spawn') #a forked child would inherit the solver environment of this process
+        results = dict()
+        running = dict() #k -> (process, connection)
+        next_k  = k0
+
+        def collect(k): #waits for the solve of k, keeping up to workers solves of the next values of k running
+            nonlocal next_k
+            while k not in results:
+                while len(running) < workers:
+                    receiver,sender = context.Pipe(duplex=False)
+                    process = context.Process(target=solve_in_process, args=(type(self), self.arguments(threads), next_k, sender), daemon=True)
+                    process.start()
+                    sender.close()
+                    running[next_k] = (process, receiver)
+                    next_k += 1
+                ready = multiprocessing.connection.wait([receiver for process,receiver in running.values()])
+                for j in [ j for j,(process,receiver) in running.items() if receiver in ready ]:
+                    process,receiver = running.pop(j)
+                    try:
+                        results[j] = receiver.recv()
+                    except EOFError: #the process died without sending its result
+                        results[j] = RuntimeError("ilp.{}.optimize_speculative: the process solving k={} exited with code {}".format(self.name, j, process.exitcode))
+                    process.join()
+                    if isinstance(results[j], ILP_Result):
+                        if self.timeline != None: #renumbered as the solves of this encoder, in order of completion
+                            self.timeline += [ (self.solves,) + sample[1:] for sample in results[j].timeline ]
+                        self.runtime += results[j].runtime
+                        self.solves  += 1
+            if isinstance(results[k], Exception):
+                raise results[k]
+            return results[k]
+
+        def cancel(): #terminates the solves that became irrelevant
+            logger.info(">>> Speculative search cancels {} solves".format(len(running)))
+            for process,receiver in running.values():
+                process.terminate()
+                process.join()
+            running.clear()
+
+        def finish(k, result):
+            cancel()
+            self.final_k   = k
+            self.k          = k
+            result.runtime  = self.runtime
+            result.timeline = self.timeline
+            return result
+
+        try:
+            previous = collect(k0)
+            if previous.status == backends.TIME_LIMIT or previous.obj == 0:
+                return finish(k0, previous)
+
+            k = k0+1
+            while True: #the same optimality criteria as optimize_linear
+                try:
+                    current = collect(k)
+                except utils.GRB_TimeOut:
+                    current = None
+                if current is None or current.status == backends.TIME_LIMIT:
+                    logger.info(">>> Time limit while optimizing with " + str(k))
+                    if current is not None and current.obj < previous.obj:
+                        return finish(k, current)
+                    previous.status = backends.TIME_LIMIT
+                    return finish(k-1, previous)
+                if current.obj >= previous.obj:
+                    return finish(k-1, previous)
+                if current.obj == 0:
+                    return finish(k, current)
+                if 1-current.obj/previous.obj < self.epsilon:
+                    return finish(k-1, previous)
+                previous = current
+                k       += 1
+        except Exception:
+            cancel()
+            raise
+
+    def optimize(self, strategy='linear', workers=2) -> ILP_Result:
+        #strategy 'linear' increments k from the edge width, 'galloping' probes exponentially from the edge width and then bisects, 'greedy' does
+        #the same starting from the size of the greedy-width decomposition, and 'speculative' solves workers consecutive values of k in parallel
+        if strategy == 'linear':
+            result = self.optimize_linear()
+        elif strategy == 'speculative':
+            result = self.optimize_speculative(workers)
+        elif strategy == 'galloping':
+            result = self.optimize_galloping(self.k)
+        elif strategy == 'greedy':
+            result = self.optimize_galloping(greedy_width(self.n, self.E, self.F, self.source, self.target))
+        else:
+            raise ValueError("Unknown search strategy '{}'".format(strategy))
+        result.solves = self.solves
+        logger.info(">>> Search strategy {} needed {} ILP solves to find k={}".format(strategy, self.solves, self.final_k))
+        return result
+
+
+def solve_in_process(encoder, arguments, k, connection):
+    #entry point of the processes of Encode_MFD.optimize_speculative: solves the encoding with k paths and sends back the result or the exception
+    try:
+        connection.send(encoder(*arguments).solve_k(k))
+    except (utils.GRB_TimeOut, utils.GRB_Infeasible) as e:
+        connection.send(e)
+    connection.close()
+
+
+def race_in_process(encoder, arguments, optimize, strategy, connection):
+    #entry point of the processes of portfolio: solves one configuration and sends back the result or the exception
+    try:
+        e = encoder(*arguments)
+        connection.send(e.optimize(strategy) if optimize else e.solve_once())
+    except (utils.GRB_TimeOut, utils.GRB_Infeasible) as e:
+        connection.send(e)
+    connection.close()
+
+
+class Encode_LeastSquares(Encode_MFD):
+
+    name = "LeastSquares"
+
+    def __init__(self,n,E,source,sink,F,edge_width,R,P2F,epsilon,timeout,threads,tight_bounds=False,symmetry=None,backend='gurobi',unitigs=False,lazy=False,timeline=False,model=None):
+        n,E,source,sink,F,R,P2F,flows = self.contract(n,E,source,sink,F,R,P2F,unitigs)
         self.n          = n
         self.m          = len(E)
         self.source     = source
         self.target     = sink
         self.E          = E
         self.F          = F
-        self.R          = R
+        self.flows      = flows #flow values of the original arcs of every arc
+        self.R          = drop_implied_subpaths(R, P2F)
         self.vars2fix   = P2F
         self.epsilon    = epsilon
+        self.symmetry   = symmetry #None, 'weights' or 'source'
+        self.tight      = tight_bounds
         self.k          = edge_width #the largest edge antichain is a lower bound for the size of any flow decomposition
         self.w_max      = max(map(lambda edge : F[edge], self.E))
+        self.arc_ub     = arc_upper_bounds(n, E, F) if tight_bounds else { e : self.w_max for e in E }
+        self.path_ub    = [ min([self.w_max] + [self.arc_ub[e] for e in P]) for P in P2F ] #the path of layer i contains every arc of P2F[i]
+        self.source_out = [ v for (u,v) in E if u == source ]
         self.edge_vars  = {}
         self.pi_vars    = {}
         self.weights    = {}
@@ -32,23 +706,25 @@ class Encode_LeastSquares:
 
         self.timeout    = timeout
         self.threads    = threads
-
-        self.model      = self.create_solver()
+        self.backend    = backend
+        self.lazy       = lazy #enforce the subpath constraints from a callback, only when an incumbent violates them
+        self.timeline   = [] if timeline else None #progress samples of every solve, see ILP_Result
+
+        self.model      = model if model != None else self.create_solver() #batches share one model among several encoders
+        if self.lazy and not self.model.lazy:
+            logger.warning("The '%s' solver backend does not support lazy constraints, encoding all subpath constraints", backend)
+            self.lazy   = False
+        if self.timeline != None and not self.model.progress:
+            logger.warning("The '%s' solver backend has no progress callbacks, recording only the final state of every solve", backend)
+        if not self.model.quadratic:
+            raise ValueError("The LeastSquares objective is quadratic, which the '{}' solver backend does not support with integer variables".format(backend))
 
         self.final_k    = None
+        self.runtime    = 0
+        self.solves     = 0
 
     def create_solver(self):
-        env = gp.Env(empty=True)
-        env.setParam('OutputFlag'   ,              0)
-        env.setParam('LogToConsole' ,              0)
-        env.setParam('TimeLimit'    ,   self.timeout)
-        env.setParam('Threads'      ,   self.threads)
-        env.start()
-        model = gp.Model("MFD_LeastSquares", env=env)
-        if not model:
-            logger.error("FATAL, could not create Gurobi model")
-            exit(0)
-        return model
+        return backends.create(self.backend, "MFD_LeastSquares", self.timeout, self.threads)
 
     def clear(self):
         self.model       = self.create_solver()
@@ -57,169 +733,119 @@ class Encode_LeastSquares:
         self.weights     = {}
         self.spc_vars    = {}
 
-    def solve(self):
-        self.model.optimize()
-
+    @stages.timed("encode")
     def encode(self):
 
         # Create variables
         edge_indexes    = [ (u,v,i) for i in range(self.k) for (u, v) in self.E        ]
         path_indexes    = [ (    i) for i in range(self.k)                             ]
         subpath_indexes = [ (i,j  ) for i in range(self.k) for j in range(len(self.R)) ]
+        edge_ub         = { (u,v,i) : min(self.arc_ub[(u,v)], self.weight_ub(i)) for (u,v,i) in edge_indexes }
+        path_ub         = { (    i) : self.weight_ub(i)                          for (    i) in path_indexes }
 
-        self.edge_vars = self.model.addVars(   edge_indexes, vtype=GRB.BINARY ,  name='e'                     )
-        self.pi_vars   = self.model.addVars(   edge_indexes, vtype=GRB.INTEGER,  name='p', lb=0, ub=self.w_max)
-        self.weights   = self.model.addVars(   path_indexes, vtype=GRB.INTEGER,  name='w', lb=1, ub=self.w_max)
-        self.spc_vars  = self.model.addVars(subpath_indexes, vtype=GRB.BINARY ,  name='r'                     )
+        self.edge_vars = self.model.add_vars(   edge_indexes, vtype=backends.BINARY ,  name='e'                     )
+        self.pi_vars   = self.model.add_vars(   edge_indexes, vtype=backends.INTEGER,  name='p', lb=0, ub=edge_ub   )
+        self.weights   = self.model.add_vars(   path_indexes, vtype=backends.INTEGER,  name='w', lb=1, ub=path_ub   )
+        self.spc_vars  = self.model.add_vars(subpath_indexes, vtype=backends.BINARY ,  name='r'                     )
 
         #The identifiers of the constraints come from https://arxiv.org/pdf/2201.10923 page 14-15
 
         for i in range(self.k):
-            self.model.addConstr( self.edge_vars.sum(self.source,'*',i) == 1, "10a_i={}".format(i) )
-            self.model.addConstr( self.edge_vars.sum('*',self.target,i) == 1, "10b_i={}".format(i) )
+            self.model.add_constr( self.edge_vars.sum(self.source,'*',i) == 1, "10a_i={}".format(i) )
+            self.model.add_constr( self.edge_vars.sum('*',self.target,i) == 1, "10b_i={}".format(i) )
 
         for i in range(self.k):
             for v in range(1,self.n-1): #find all wedges u->v->w for v in V\{s,t}
-                self.model.addConstr( self.edge_vars.sum('*',v,i) - self.edge_vars.sum(v,'*',i) == 0, "10c_v={}_i={}".format(v,i) )
+                self.model.add_constr( self.edge_vars.sum('*',v,i) - self.edge_vars.sum(v,'*',i) == 0, "10c_v={}_i={}".format(v,i) )
 
         for (u,v) in self.E:
             for i in range(self.k):
-                self.model.addConstr( self.pi_vars[u,v,i] <= self.edge_vars[u,v,i] * self.w_max                         , "10e_u={}_v={}_i={}".format(u,v,i) )
-                self.model.addConstr( self.pi_vars[u,v,i] <= self.weights[i]                                            , "10f_u={}_v={}_i={}".format(u,v,i) )
-                self.model.addConstr( self.pi_vars[u,v,i] >= self.weights[i] - (1 - self.edge_vars[u,v,i]) * self.w_max , "10g_u={}_v={}_i={}".format(u,v,i) )
+                self.model.add_constr( self.pi_vars[u,v,i] <= self.edge_vars[u,v,i] * edge_ub[u,v,i]                          , "10e_u={}_v={}_i={}".format(u,v,i) )
+                self.model.add_constr( self.pi_vars[u,v,i] <= self.weights[i]                                                , "10f_u={}_v={}_i={}".format(u,v,i) )
+                self.model.add_constr( self.pi_vars[u,v,i] >= self.weights[i] - (1 - self.edge_vars[u,v,i]) * path_ub[i]     , "10g_u={}_v={}_i={}".format(u,v,i) )
                 
         #Example of a subpath constraint: R=[ [(1,3),(3,5)], [(0,1)] ], means that we have 2 paths to cover, the first one is 1-3-5. the second path is just a single edge 0-1
         def EncodeSubpathConstraints():
             for i in range(self.k):
                 for j in range(len(self.R)):
                     edgevars_on_subpath = list(map(lambda e: self.edge_vars[e[0],e[1],i], self.R[j]))
-                    self.model.addConstr( sum(edgevars_on_subpath) >= len(self.R[j]) * self.spc_vars[i,j] )
+                    self.model.add_constr( sum(edgevars_on_subpath) >= len(self.R[j]) * self.spc_vars[i,j] )
             for j in range(len(self.R)):
-                self.model.addConstr( self.spc_vars.sum('*',j) >= 1 )
+                self.model.add_constr( self.spc_vars.sum('*',j) >= 1 )
 
         def Fix_Variables():
             for i in range(len(self.vars2fix)):
                 for (u,v) in self.vars2fix[i]:
-                    self.model.addConstr( self.edge_vars[u,v,i] == 1 )
+                    self.model.add_constr( self.edge_vars[u,v,i] == 1 )
+
+        #The layers not fixed to safe sequences can be permuted freely, so we only keep the solutions whose unfixed layers are sorted by non-increasing
+        #weight ('weights') or by non-decreasing index of their first arc out of the source ('source')
+        def Break_Symmetries():
+            first_arc = lambda i : sum( j * self.edge_vars[self.source,v,i] for j,v in enumerate(self.source_out) )
+            for i in range(len(self.vars2fix), self.k-1):
+                if self.symmetry == 'weights':
+                    self.model.add_constr( self.weights[i] >= self.weights[i+1], "sym_i={}".format(i) )
+                elif self.symmetry == 'source':
+                    self.model.add_constr( first_arc(i) <= first_arc(i+1)      , "sym_i={}".format(i) )
         
-        if self.R!=[]:
+        if self.R!=[] and self.lazy:
+            self.separated = set() #indexes of the subpath constraints added at least once
+            self.model.add_callback(backends.MIPSOL, self.separate_subpath_constraints, lazy=True)
+        elif self.R!=[]:
             EncodeSubpathConstraints()
 
+        if self.timeline != None and self.model.progress:
+            self.model.add_callback(backends.MIP   , self.record_progress)
+            self.model.add_callback(backends.MIPSOL, self.record_progress)
+
         if self.vars2fix!=[]:
             Fix_Variables()
 
-        self.model.setObjective( sum( (self.F[(u,v)] - self.pi_vars.sum(u,v,'*') )**2 for (u,v) in self.E), GRB.MINIMIZE )
-
-    def print_solution(self,solution):
-        opt, dif, paths = solution
-        print("\n#####SOLUTION#####\n","> FD size   :",   opt,"\n> LeastSquares difference :", dif,"\n> Weight-Path decomposition:")
-        for p in paths:
+        if self.symmetry!=None:
+            Break_Symmetries()
+
+        self.objective = sum( (f - self.pi_vars.sum(u,v,'*') )**2 for (u,v) in self.E for f in self.flows[(u,v)])
+        self.model.set_objective( self.objective )
+
+    @staticmethod
+    def path_optimum(flows, paths):
+        #(total weight, objective, None) of the given number of paths alone on a group of arcs with the given flow values. Several paths on the same
+        #arcs act as one path whose weight is their sum, which is best at the integer closest to the mean of the flow values, on either side
+        if paths == 0:
+            return 0, sum( f**2 for f in flows ), None
+        mean   = sum(flows)//len(flows)
+        errors = { weight : sum( (f-weight)**2 for f in flows ) for weight in set([max(paths,mean), max(paths,mean+1)]) }
+        weight = min(errors, key=lambda weight : (errors[weight], weight))
+        return weight, errors[weight], None
+
+    def print_solution(self,result):
+        print("\n#####SOLUTION#####\n","> FD size   :",   result.k,"\n> LeastSquares difference :", result.obj,"\n> Weight-Path decomposition:")
+        for p in result.solution:
             print(*p)
-    
-    def build_solution(self):
-        paths = []
-        for i in range(self.k):
-            path = []
-            u    = self.source
-            while u != self.target:
-                edges = list(filter(lambda grb_var : grb_var.X>1-TOLERANCE , self.edge_vars.select(u,'*',i) ))
-                assert(len(edges)==1)
-                v = head(edges[0].VarName)
-                path.append(v)
-                u = v
-            paths.append( (self.weights[i].X, path[:-1]) )
-
-        return (self.k, self.model.ObjVal, paths)
-
-    def solve_once(self):   
-        logger.info(">>> Solving once")            
-        self.encode()
-        self.solve()
-        logger.info("Gurobi solver status " + str(self.model.status))
-        if self.model.status == GRB.TIME_LIMIT:
-            raise utils.GRB_TimeOut("ilp.LeastSquares.solve_once while finding feasible solution")
-        elif self.model.status == GRB.INFEASIBLE:
-            raise utils.GRB_Infeasible("ilp.LeastSquares.solve_once while finding feasible solution")
-        elif self.model.status == GRB.OPTIMAL:
-            _,_,p = self.build_solution()
-            weights,paths = list(map(lambda x : x[0], p)), list(map(lambda x : x[1], p))
-            #return (paths,weights)
-            return self.model.ObjVal
-        else:
-            logger.error("FATAL: solver finished with status " + str(self.model.status) + ", which is not: OPT, TIME_LIMIT, INFEASIBLE.")
-
-    def optimize_linear(self):
-        #Assumption: the initial value of self.k is sufficiently high so that the ILP solver starts with a feasible solution
 
-        self.encode()
-        self.solve()
-        if self.model.status == GRB.TIME_LIMIT:
-            self.final_k = self.k
-            raise utils.GRB_TimeOut("ilp.LeastSquares.optimize_linear in the feasibility stage of the optimization loop")
-        elif self.model.status == GRB.INFEASIBLE:
-            self.final_k = self.k
-            raise utils.GRB_Infeasible("ilp.LeastSquares.optimize_linear in the feasibility stage of the optimization loop")
-        prev_obj = self.model.ObjVal
+class Encode_Robust(Encode_MFD):
 
-        if prev_obj == 0:
-            logger.info(">>> No optimization step required, found perfect solution in init solving with " + str(self.k))
-            self.final_k = self.k
-            return self.final_k
-
-        self.clear()
-        self.k += 1
-
-        logger.info(">>> Optimality, starting with " + str(self.k))
-        while True: #optimality criteria: find the k for which the ratio of slacks between two consecutive iterations becomes sufficiently small
-
-            self.encode()
-            self.solve()
-            logger.info("Gurobi solver status " + str(self.model.status))
-
-            if self.model.status == GRB.TIME_LIMIT:
-                self.final_k = self.k - 1
-                raise utils.GRB_TimeOut("ilp.LeastSquares.optimize_linear while optimizing")
-            elif self.model.status == GRB.INFEASIBLE:
-                self.final_k = self.k - 1
-                raise utils.GRB_Infeasible("ilp.LeastSquares.optimize_linear while optimizing")
-            #assert(self.model.ObjVal <= prev_obj) not necessarily true, as the lower bound of the weight variables is 1
-
-            if self.model.ObjVal >= prev_obj: #if we do not improve by allowing more paths we stop
-                self.final_k = self.k-1
-                break
-
-            if self.model.ObjVal==0: #if we found a perfect solution we stop
-                self.final_k = self.k
-                break
+    name = "Robust"
 
-            assert(prev_obj != 0)
-
-            if 1-self.model.ObjVal/prev_obj < self.epsilon: # if the relative improvement is small we also stop
-                self.final_k = self.k - 1
-                break
-            
-            prev_obj = self.model.ObjVal
-            self.clear()
-            self.k += 1
-        
-        return self.final_k
-
-
-
-class Encode_Robust:
-
-    def __init__(self,n,E,source,sink,F,edge_width,R,P2F,epsilon,timeout,threads):
+    def __init__(self,n,E,source,sink,F,edge_width,R,P2F,epsilon,timeout,threads,tight_bounds=False,symmetry=None,backend='gurobi',unitigs=False,lazy=False,timeline=False,model=None):
+        n,E,source,sink,F,R,P2F,flows = self.contract(n,E,source,sink,F,R,P2F,unitigs)
         self.n          = n
         self.m          = len(E)
         self.source     = source
         self.target     = sink
         self.E          = E
         self.F          = F
-        self.R          = R
+        self.flows      = flows #flow values of the original arcs of every arc
+        self.R          = drop_implied_subpaths(R, P2F)
         self.vars2fix   = P2F
         self.epsilon    = epsilon
+        self.symmetry   = symmetry #None, 'weights' or 'source'
+        self.tight      = tight_bounds
         self.k          = edge_width #the largest edge antichain is a lower bound for the size of any flow decomposition
         self.w_max      = max(map(lambda edge : F[edge], self.E))
+        self.arc_ub     = arc_upper_bounds(n, E, F) if tight_bounds else { e : self.w_max for e in E }
+        self.path_ub    = [ min([self.w_max] + [self.arc_ub[e] for e in P]) for P in P2F ] #the path of layer i contains every arc of P2F[i]
+        self.source_out = [ v for (u,v) in E if u == source ]
         self.edge_vars  = {}
         self.phi_vars   = {}
         self.gam_vars   = {}
@@ -229,23 +855,23 @@ class Encode_Robust:
 
         self.timeout    = timeout
         self.threads    = threads
+        self.backend    = backend
+        self.lazy       = lazy #enforce the subpath constraints from a callback, only when an incumbent violates them
+        self.timeline   = [] if timeline else None #progress samples of every solve, see ILP_Result
 
-        self.model      = self.create_solver()
+        self.model      = model if model != None else self.create_solver() #batches share one model among several encoders
+        if self.lazy and not self.model.lazy:
+            logger.warning("The '%s' solver backend does not support lazy constraints, encoding all subpath constraints", backend)
+            self.lazy   = False
+        if self.timeline != None and not self.model.progress:
+            logger.warning("The '%s' solver backend has no progress callbacks, recording only the final state of every solve", backend)
 
         self.final_k    = None
+        self.runtime    = 0
+        self.solves     = 0
 
     def create_solver(self):
-        env = gp.Env(empty=True)
-        env.setParam('OutputFlag'   ,              0)
-        env.setParam('LogToConsole' ,              0)
-        env.setParam('TimeLimit'    ,   self.timeout)
-        env.setParam('Threads'      ,   self.threads)
-        env.start()
-        model = gp.Model("MFD_Robust", env=env)
-        if not model:
-            logger.error("FATAL, could not create Gurobi model")
-            exit(0)
-        return model
+        return backends.create(self.backend, "MFD_Robust", self.timeout, self.threads)
 
     def clear(self):
         self.model       = self.create_solver()
@@ -256,165 +882,232 @@ class Encode_Robust:
         self.slacks      = {}
         self.spc_vars    = {}
 
-    def solve(self):
-        self.model.optimize()
-
+    @stages.timed("encode")
     def encode(self):
 
         # Create variables
         edge_indexes    = [ (u,v,i) for i in range(self.k) for (u, v) in self.E        ]
         path_indexes    = [ (    i) for i in range(self.k)                             ]
         subpath_indexes = [ (i,j  ) for i in range(self.k) for j in range(len(self.R)) ]
+        edge_ub         = { (u,v,i) : min(self.arc_ub[(u,v)], self.weight_ub(i)) for (u,v,i) in edge_indexes }
+        path_ub         = { (    i) : self.weight_ub(i)                          for (    i) in path_indexes }
 
-        self.edge_vars = self.model.addVars(   edge_indexes, vtype=GRB.BINARY ,  name='e'                     )
-        self.spc_vars  = self.model.addVars(subpath_indexes, vtype=GRB.BINARY ,  name='r'                     )
-        self.phi_vars  = self.model.addVars(   edge_indexes, vtype=GRB.INTEGER,  name='p', lb=0, ub=self.w_max)
-        self.gam_vars  = self.model.addVars(   edge_indexes, vtype=GRB.INTEGER,  name='g', lb=0, ub=self.w_max)
-        self.weights   = self.model.addVars(   path_indexes, vtype=GRB.INTEGER,  name='w', lb=1, ub=self.w_max)
-        self.slacks    = self.model.addVars(   path_indexes, vtype=GRB.INTEGER,  name='s', lb=0, ub=self.w_max)
+        self.edge_vars = self.model.add_vars(   edge_indexes, vtype=backends.BINARY ,  name='e'                     )
+        self.spc_vars  = self.model.add_vars(subpath_indexes, vtype=backends.BINARY ,  name='r'                     )
+        self.phi_vars  = self.model.add_vars(   edge_indexes, vtype=backends.INTEGER,  name='p', lb=0, ub=edge_ub   )
+        self.gam_vars  = self.model.add_vars(   edge_indexes, vtype=backends.INTEGER,  name='g', lb=0, ub=self.w_max)
+        self.weights   = self.model.add_vars(   path_indexes, vtype=backends.INTEGER,  name='w', lb=1, ub=path_ub   )
+        self.slacks    = self.model.add_vars(   path_indexes, vtype=backends.INTEGER,  name='s', lb=0, ub=self.w_max)
 
         #The identifiers of the constraints come from https://www.biorxiv.org/content/10.1101/2023.03.20.533019v1.full.pdf page 13
 
         for i in range(self.k):
-            self.model.addConstr( self.edge_vars.sum(self.source,'*',i) == 1, "14a_i={}".format(i) )
-            self.model.addConstr( self.edge_vars.sum('*',self.target,i) == 1, "14b_i={}".format(i) )
+            self.model.add_constr( self.edge_vars.sum(self.source,'*',i) == 1, "14a_i={}".format(i) )
+            self.model.add_constr( self.edge_vars.sum('*',self.target,i) == 1, "14b_i={}".format(i) )
 
         for i in range(self.k):
             for v in range(1,self.n-1): #find all wedges u->v->w for v in V\{s,t}
-                self.model.addConstr( self.edge_vars.sum('*',v,i) - self.edge_vars.sum(v,'*',i) == 0, "14c_v={}_i={}".format(v,i) )
+                self.model.add_constr( self.edge_vars.sum('*',v,i) - self.edge_vars.sum(v,'*',i) == 0, "14c_v={}_i={}".format(v,i) )
 
-        for (u,v) in self.E:
-            f_uv    = self.F[(u,v)]
+        for (u,v) in self.E: #on a contracted unitig, 14d and 14e of all its arcs are implied by those of its largest and smallest flow values
             phi_sum = self.phi_vars.sum(u,v,'*')
             gam_sum = self.gam_vars.sum(u,v,'*')
-            self.model.addConstr( f_uv - phi_sum <=  gam_sum, "14d_u={}_v={}".format(u,v) )
-            self.model.addConstr( f_uv - phi_sum >= -gam_sum, "14e_u={}_v={}".format(u,v) )
+            self.model.add_constr( max(self.flows[(u,v)]) - phi_sum <=  gam_sum, "14d_u={}_v={}".format(u,v) )
+            self.model.add_constr( min(self.flows[(u,v)]) - phi_sum >= -gam_sum, "14e_u={}_v={}".format(u,v) )
             for i in range(self.k):
-                self.model.addConstr( self.phi_vars[u,v,i] <= self.w_max * self.edge_vars[u,v,i]                        , "14f_u={}_v={}_i={}".format(u,v,i) )
-                self.model.addConstr( self.gam_vars[u,v,i] <= self.w_max * self.edge_vars[u,v,i]                        , "14i_u={}_v={}_i={}".format(u,v,i) )
-                self.model.addConstr( self.phi_vars[u,v,i] <= self.weights[i]                                           , "14g_u={}_v={}_i={}".format(u,v,i) )
-                self.model.addConstr( self.gam_vars[u,v,i] <= self.slacks [i]                                           , "14j_u={}_v={}_i={}".format(u,v,i) )
-                self.model.addConstr( self.phi_vars[u,v,i] >= self.weights[i] - (1 - self.edge_vars[u,v,i]) * self.w_max, "14h_u={}_v={}_i={}".format(u,v,i) )
-                self.model.addConstr( self.gam_vars[u,v,i] >= self.slacks [i] - (1 - self.edge_vars[u,v,i]) * self.w_max, "14k_u={}_v={}_i={}".format(u,v,i) )
+                self.model.add_constr( self.phi_vars[u,v,i] <= edge_ub[u,v,i] * self.edge_vars[u,v,i]                    , "14f_u={}_v={}_i={}".format(u,v,i) )
+                self.model.add_constr( self.gam_vars[u,v,i] <= self.w_max * self.edge_vars[u,v,i]                        , "14i_u={}_v={}_i={}".format(u,v,i) )
+                self.model.add_constr( self.phi_vars[u,v,i] <= self.weights[i]                                           , "14g_u={}_v={}_i={}".format(u,v,i) )
+                self.model.add_constr( self.gam_vars[u,v,i] <= self.slacks [i]                                           , "14j_u={}_v={}_i={}".format(u,v,i) )
+                self.model.add_constr( self.phi_vars[u,v,i] >= self.weights[i] - (1 - self.edge_vars[u,v,i]) * path_ub[i] , "14h_u={}_v={}_i={}".format(u,v,i) )
+                self.model.add_constr( self.gam_vars[u,v,i] >= self.slacks [i] - (1 - self.edge_vars[u,v,i]) * self.w_max, "14k_u={}_v={}_i={}".format(u,v,i) )
 
         #Example of a subpath constraint: R=[ [(1,3),(3,5)], [(0,1)] ], means that we have 2 paths to cover, the first one is 1-3-5. the second path is just a single edge 0-1
         def EncodeSubpathConstraints():
             for i in range(self.k):
                 for j in range(len(self.R)):
                     edgevars_on_subpath = list(map(lambda e: self.edge_vars[e[0],e[1],i], self.R[j]))
-                    self.model.addConstr( sum(edgevars_on_subpath) >= len(self.R[j]) * self.spc_vars[i,j] )
+                    self.model.add_constr( sum(edgevars_on_subpath) >= len(self.R[j]) * self.spc_vars[i,j] )
             for j in range(len(self.R)):
-                self.model.addConstr( self.spc_vars.sum('*',j) >= 1 )
+                self.model.add_constr( self.spc_vars.sum('*',j) >= 1 )
 
         def Fix_Variables():
             for i in range(len(self.vars2fix)):
                 for (u,v) in self.vars2fix[i]:
-                    self.model.addConstr( self.edge_vars[u,v,i] == 1 )
+                    self.model.add_constr( self.edge_vars[u,v,i] == 1 )
+
+        #The layers not fixed to safe sequences can be permuted freely, so we only keep the solutions whose unfixed layers are sorted by non-increasing
+        #weight ('weights') or by non-decreasing index of their first arc out of the source ('source')
+        def Break_Symmetries():
+            first_arc = lambda i : sum( j * self.edge_vars[self.source,v,i] for j,v in enumerate(self.source_out) )
+            for i in range(len(self.vars2fix), self.k-1):
+                if self.symmetry == 'weights':
+                    self.model.add_constr( self.weights[i] >= self.weights[i+1], "sym_i={}".format(i) )
+                elif self.symmetry == 'source':
+                    self.model.add_constr( first_arc(i) <= first_arc(i+1)      , "sym_i={}".format(i) )
         
-        if self.R!=[]:
+        if self.R!=[] and self.lazy:
+            self.separated = set() #indexes of the subpath constraints added at least once
+            self.model.add_callback(backends.MIPSOL, self.separate_subpath_constraints, lazy=True)
+        elif self.R!=[]:
             EncodeSubpathConstraints()
 
+        if self.timeline != None and self.model.progress:
+            self.model.add_callback(backends.MIP   , self.record_progress)
+            self.model.add_callback(backends.MIPSOL, self.record_progress)
+
         if self.vars2fix!=[]:
             Fix_Variables()
 
-        self.model.setObjective( self.slacks.sum(), GRB.MINIMIZE )
-
-    def print_solution(self,solution):
-        opt, slack, paths = solution
-        print("\n#####SOLUTION#####\n","> FD size   :",   opt,"\n> Slack sum :", slack,"\n> Weight-Slack-Path decomposition:")
-        for p in paths:
+        if self.symmetry!=None:
+            Break_Symmetries()
+
+        self.objective = self.slacks.sum()
+        self.model.set_objective( self.objective )
+
+    @staticmethod
+    def path_optimum(flows, paths):
+        #(total weight, objective, total slack) of the given number of paths alone on a group of arcs with the given flow values, or None if infeasible.
+        #Several paths on the same arcs act as one path whose weight is their sum, which is best halfway between the smallest and largest flow values
+        if paths == 0:
+            return (0, 0, 0) if max(flows, default=0) == 0 else None
+        weight = max(paths, (min(flows)+max(flows))//2)
+        slack  = max(max(flows)-weight, weight-min(flows))
+        return weight, slack, slack
+
+    def print_solution(self,result):
+        print("\n#####SOLUTION#####\n","> FD size   :",   result.k,"\n> Slack sum :", result.obj,"\n> Weight-Slack-Path decomposition:")
+        for p in result.solution:
             print(*p)
-    
-    def build_solution(self):
-        paths = []
-        for i in range(self.k):
-            path = []
-            u    = self.source
-            while u != self.target:
-                edges = list(filter(lambda grb_var : grb_var.X>1-TOLERANCE , self.edge_vars.select(u,'*',i) ))
-                assert(len(edges)==1)
-                v = head(edges[0].VarName)
-                path.append(v)
-                u = v
-            paths.append( (self.weights[i].X, self.slacks[i].X, path[:-1]) )
 
-        return (self.k, self.model.ObjVal, paths)
-
-    def solve_once(self):
-        logger.info(">>> Solving once")            
-        self.encode()
-        self.solve()
-        logger.info("Gurobi solver status " + str(self.model.status))
-        if self.model.status == GRB.TIME_LIMIT:
-            raise utils.GRB_TimeOut("ilp.Robust.solve_once while finding feasible solution")
-        elif self.model.status == GRB.INFEASIBLE:
-            raise utils.GRB_Infeasible("ilp.Robust.solve_once while finding feasible solution")
-        elif self.model.status == GRB.OPTIMAL:
-            _,_,p = self.build_solution()
-            weights,paths,slacks = list(map(lambda x : x[0], p)), list(map(lambda x : x[2], p)), list(map(lambda x : x[1], p))
-            return (paths,weights,slacks,self.model.ObjVal)
-            #return self.model.ObjVal
-        else:
-            logger.error("FATAL: solver finished with status " + str(self.model.status) + ", which is not: OPT, TIME_LIMIT, INFEASIBLE.")
-
-    def optimize_linear(self):
-        #Assumption: the initial value of self.k is sufficiently high so that the ILP solver starts with a feasible solution
-
-        self.encode()
-        self.solve()
-        if self.model.status == GRB.TIME_LIMIT:
-            self.final_k = self.k
-            raise utils.GRB_TimeOut("ilp.Robust.optimize_linear in the feasibility stage of the optimization loop")
-        elif self.model.status == GRB.INFEASIBLE:
-            self.final_k = self.k
-            raise utils.GRB_Infeasible("ilp.Robust.optimize_linear in th feasibility stage of the optimization loop")
-        previous_slack = self.model.ObjVal
-
-        if previous_slack == 0:
-            logger.info(">>> No optimization step required, found perfect solution in init solving with " + str(self.k))
-            self.final_k = self.k
-            return self.final_k
-
-        self.clear()
-        self.k += 1
-
-        logger.info(">>> Optimality, starting with " + str(self.k))
-        while True: #optimality criteria: find the k for which the ratio of slacks between two consecutive iterations becomes sufficiently small
-
-            self.encode()
-            self.solve()
-            logger.info("Gurobi solver status " + str(self.model.status))
-
-            if self.model.status == GRB.TIME_LIMIT:
-                self.final_k = self.k-1
-                raise utils.GRB_TimeOut("ilp.Robust.optimize_linear while optimizing")
-            elif self.model.status == GRB.INFEASIBLE:
-                self.final_k = self.k-1
-                raise utils.GRB_Infeasible("ilp.Robust.optimize_linear while optimizing")
-            #assert(self.model.ObjVal <= previous_slack) not necessarily true, as the lower bound of the weight variables is 1
-
-            if self.model.ObjVal >= previous_slack: #if we do not improve by allowing more paths we stop
-                self.final_k = self.k-1
-                break
-            
-            if self.model.ObjVal==0: #if we found a perfect solution we stop
-                self.final_k = self.k
-                break
-            
-            assert(previous_slack != 0)
-
-            if 1-self.model.ObjVal/previous_slack < self.epsilon: # if the relative improvement is small we also stop
-                self.final_k = self.k-1
-                break
-            
-            previous_slack = self.model.ObjVal
-            self.clear()
-            self.k += 1
-        
-        return self.final_k
+    @stages.timed("extract")
+    def build_solution(self) -> Decomposition:
+        solution        = super().build_solution()
+        solution.slacks = list(map(round, self.model.values(list(self.slacks.values()))))
+        return solution
 
     
-def robust(G : graph.st_DAG, epsilon=0.25, timeout=300, threads=4, path_constraints=[], vars_to_fix=[], optimize=False):
+def batchable(G : graph.st_DAG, max_arcs, max_width) -> bool:
+    #graphs so small that creating their own solver model costs more than solving them are better solved in a batch
+    return 0 < len(G.edge_list) <= max_arcs and G.w <= max_width
+
+
+def solve_batch(encoder, model_name, graphs, vars_to_fix, epsilon, timeout, threads, tight_bounds, symmetry, backend, unitigs, batch_size) -> list:
+    #Solves every graph with k=w paths, as solve_once does, packing up to batch_size graphs into one model as disjoint blocks whose objective is the
+    #sum of the objectives of the blocks. Returns for every graph its ILP_Result, whose runtime is an even share of the runtime of its batch, or the
+    #exception that solving it alone raises. A batch without a solution (one infeasible graph makes the whole batch infeasible) is solved graph by graph
+    vars_to_fix = vars_to_fix if vars_to_fix != None else [ [] for _ in graphs ]
+    results     = [ forced_result(encoder, G, [], P2F, False) for G,P2F in zip(graphs, vars_to_fix) ]
+    unforced    = [ i for i in range(len(graphs)) if results[i] == None ]
+    for start in range(0, len(unforced), batch_size):
+        batch    = unforced[start:start+batch_size]
+        model    = backends.create(backend, model_name, timeout, threads)
+        encoders = [ encoder(G.n, G.edge_list, G.source, G.sink, G.flow, G.w, [], P2F, epsilon, timeout, threads, tight_bounds, symmetry, backend, unitigs, model=model) for G,P2F in map(lambda i : (graphs[i], vars_to_fix[i]), batch) ]
+        for e in encoders:
+            e.encode()
+        model.set_objective( model.quicksum( e.objective for e in encoders ) )
+        model.optimize()
+        logger.info("Solver status %s on a batch of %d graphs in %f seconds", model.status, len(batch), model.runtime)
+
+        if model.sol_count > 0 and model.status in [backends.OPTIMAL, backends.TIME_LIMIT]:
+            for i,e in zip(batch, encoders):
+                results[i] = e.block_result(model.runtime/len(batch))
+            continue
+
+        for i in batch:
+            G,P2F = graphs[i], vars_to_fix[i]
+            try:
+                results[i] = encoder(G.n, G.edge_list, G.source, G.sink, G.flow, G.w, [], P2F, epsilon, timeout, threads, tight_bounds, symmetry, backend, unitigs).solve_once()
+            except (utils.GRB_TimeOut, utils.GRB_Infeasible) as e:
+                results[i] = e
+    return results
+
+
+def robust_batch(graphs : list, epsilon=0.25, timeout=300, threads=4, vars_to_fix=None, tight_bounds=False, symmetry=None, backend='gurobi', unitigs=False, batch_size=100):
+    logger.info("Robust BEGIN on a batch of %d graphs", len(graphs))
+    return solve_batch(Encode_Robust, "MFD_Robust", graphs, vars_to_fix, epsilon, timeout, threads, tight_bounds, symmetry, backend, unitigs, batch_size)
+
+
+def leastsquares_batch(graphs : list, epsilon=0.25, timeout=300, threads=4, vars_to_fix=None, tight_bounds=False, symmetry=None, backend='gurobi', unitigs=False, batch_size=100):
+    logger.info("LeastSquares BEGIN on a batch of %d graphs", len(graphs))
+    return solve_batch(Encode_LeastSquares, "MFD_LeastSquares", graphs, vars_to_fix, epsilon, timeout, threads, tight_bounds, symmetry, backend, unitigs, batch_size)
+
+
+PORTFOLIO = ['vanilla', 'fixed', 'subpaths', 'unitigs']
+
+
+def portfolio_configurations(names, P2F, implied) -> dict:
+    #the (subpath constraints, safe sequences to fix, unitigs) of the named configurations: vanilla has no safety information, fixed fixes the safe
+    #sequences of the antichain to paths, subpaths gives them and the other safe sequences as subpath constraints, and unitigs fixes them on the
+    #unitig-contracted graph
+    configurations = { 'vanilla' : ([], [], False), 'fixed' : ([], P2F, False), 'subpaths' : (P2F + implied, [], False), 'unitigs' : ([], P2F, True) }
+    return { name : configurations[name] for name in names }
+
+
+def portfolio(encoder, G : graph.st_DAG, configurations : dict, epsilon, timeout, threads, optimize, tight_bounds, symmetry, backend, strategy, lazy, timeline) -> tuple:
+    #Solves G with every configuration at the same time in separate processes, each with an equal share of the threads, and returns the name of the
+    #first configuration whose result is proven optimal together with that result, terminating the other solves. When the weights form a flow, all the
+    #configurations have the same optimum, since every safe sequence belongs to some path of any decomposition (the same assumption as fixing safe
+    #sequences in the demos). If none is proven optimal, the best result found is returned
+    for name,(R,P2F,unitigs) in configurations.items():
+        result = forced_result(encoder, G, R, P2F, optimize, epsilon)
+        if result != None:
+            return name, result
+
+    share    = max(1, threads//len(configurations))
+    strategy = 'linear' if strategy == 'speculative' else strategy #the processes of the portfolio cannot start processes of their own
+    context  = multiprocessing.get_context('spawn')
+    running  = dict() #connection -> (name, process)
+    for name,(R,P2F,unitigs) in configurations.items():
+        receiver,sender = context.Pipe(duplex=False)
+        arguments = (G.n, G.edge_list, G.source, G.sink, G.flow, G.w, R, P2F, epsilon, timeout, share, tight_bounds, symmetry, backend, unitigs, lazy, timeline)
+        process   = context.Process(target=race_in_process, args=(encoder, arguments, optimize, strategy, sender), daemon=True)
+        process.start()
+        sender.close()
+        running[receiver] = (name, process)
+
+    best,failure = None,None
+    try:
+        while len(running) > 0:
+            for receiver in multiprocessing.connection.wait(list(running)):
+                name,process = running.pop(receiver)
+                try:
+                    result = receiver.recv()
+                except EOFError: #the process died without sending its result
+                    result = RuntimeError("ilp.portfolio: the process solving configuration {} exited with code {}".format(name, process.exitcode))
+                process.join()
+                if isinstance(result, Exception):
+                    logger.info(">>> Portfolio configuration %s failed: %s", name, result)
+                    failure = failure if failure != None else result
+                    continue
+                logger.info(">>> Portfolio configuration %s finished with status %s and objective %s", name, result.status, result.obj)
+                if result.is_optimal():
+                    return name, result
+                if best == None or result.obj < best[1].obj:
+                    best = (name, result)
+    finally:
+        if len(running) > 0:
+            logger.info(">>> Portfolio cancels %s", ", ".join( name for name,process in running.values() ))
+        for name,process in running.values():
+            process.terminate()
+            process.join()
+
+    if best != None:
+        return best
+    raise failure
+
+
+def robust_portfolio(G : graph.st_DAG, configurations : dict, epsilon=0.25, timeout=300, threads=4, optimize=False, tight_bounds=False, symmetry=None, backend='gurobi', strategy='linear', lazy=False, timeline=False):
+    logger.info("Robust portfolio BEGIN on graph %s with %s", G.id, ", ".join(configurations))
+    return portfolio(Encode_Robust, G, configurations, epsilon, timeout, threads, optimize, tight_bounds, symmetry, backend, strategy, lazy, timeline)
+
+
+def leastsquares_portfolio(G : graph.st_DAG, configurations : dict, epsilon=0.25, timeout=300, threads=4, optimize=False, tight_bounds=False, symmetry=None, backend='gurobi', strategy='linear', lazy=False, timeline=False):
+    logger.info("LeastSquares portfolio BEGIN on graph %s with %s", G.id, ", ".join(configurations))
+    return portfolio(Encode_LeastSquares, G, configurations, epsilon, timeout, threads, optimize, tight_bounds, symmetry, backend, strategy, lazy, timeline)
+
+
+def robust(G : graph.st_DAG, epsilon=0.25, timeout=300, threads=4, path_constraints=[], vars_to_fix=[], optimize=False, tight_bounds=False, symmetry=None, backend='gurobi', strategy='linear', workers=2, unitigs=False, lazy=False, timeline=False):
 
     logger.info("Robust BEGIN on graph %s", G.id)
 
@@ -423,17 +1116,18 @@ def robust(G : graph.st_DAG, epsilon=0.25, timeout=300, threads=4, path_constrai
         #return []
         return -1
     
-    encoder = Encode_Robust(G.n, G.edge_list, G.source, G.sink, G.flow, G.w, path_constraints, vars_to_fix, epsilon, timeout, threads)
+    result = forced_result(Encode_Robust, G, path_constraints, vars_to_fix, optimize, epsilon)
+    if result != None:
+        return result
+
+    encoder = Encode_Robust(G.n, G.edge_list, G.source, G.sink, G.flow, G.w, path_constraints, vars_to_fix, epsilon, timeout, threads, tight_bounds, symmetry, backend, unitigs, lazy, timeline)
 
     if optimize:
-        _,_,_,x = encoder.optimize_linear() #return (paths,weights,slacks,self.model.ObjVal)
-        return x
+        return encoder.optimize(strategy, workers)
     else:
         return encoder.solve_once()
-        #return (paths,weights)
-        #return x
 
-def leastsquares(G : graph.st_DAG, epsilon=0.25, timeout=300, threads=4, path_constraints=[], vars_to_fix=[], optimize=False):
+def leastsquares(G : graph.st_DAG, epsilon=0.25, timeout=300, threads=4, path_constraints=[], vars_to_fix=[], optimize=False, tight_bounds=False, symmetry=None, backend='gurobi', strategy='linear', workers=2, unitigs=False, lazy=False, timeline=False):
 
     logger.info("LeastSquares BEGIN on graph %s", G.id)
 
@@ -442,10 +1136,13 @@ def leastsquares(G : graph.st_DAG, epsilon=0.25, timeout=300, threads=4, path_co
         #return []
         return -1
     
-    encoder = Encode_LeastSquares(G.n, G.edge_list, G.source, G.sink, G.flow, G.w, path_constraints, vars_to_fix, epsilon, timeout, threads)
+    result = forced_result(Encode_LeastSquares, G, path_constraints, vars_to_fix, optimize, epsilon)
+    if result != None:
+        return result
+
+    encoder = Encode_LeastSquares(G.n, G.edge_list, G.source, G.sink, G.flow, G.w, path_constraints, vars_to_fix, epsilon, timeout, threads, tight_bounds, symmetry, backend, unitigs, lazy, timeline)
 
     if optimize:
-        return encoder.optimize_linear()
+        return encoder.optimize(strategy, workers)
     else:
         return encoder.solve_once()
-        #return (paths,weights)
\ No newline at end of file
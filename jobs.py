@@ -0,0 +1,271 @@
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import multiprocessing
+import threading
+import safety
+import ilp
+import utils
+
+logger = logging.getLogger(__name__)
+
+#the functions run by the jobs of every kind in the worker processes
+TASKS  = { "robust"       : ilp.robust,
+           "leastsquares" : ilp.leastsquares,
+           "dominators"   : lambda G : safe_sequences(G, safety.maximal_safe_sequences_via_dominators(G, set(G.edge_list))),
+           "maximal"      : lambda G : safe_sequences(G, safety.maximal_safe_sequences(G, G.edge_list)) }
+SOLVES = ["robust", "leastsquares"] #the kinds solving ILPs, which are cancelled by terminating their solver and report progress
+
+
+def safe_sequences(G, safe_seqs) -> tuple:
+    return safe_seqs, utils.sequences_to_fix(G, safe_seqs)
+
+
+class Job_Cancelled(Exception):
+    pass
+
+
+class Job_Watcher:
+    #Watches the job run by a worker process (see ilp.watcher): every solve of the job reports its progress samples to the queue, and a thread waiting
+    #for the cancel event terminates the model being solved, after which the job stops with Job_Cancelled instead of solving further models
+
+    def __init__(self, connection, cancel):
+        self.connection = connection
+        self.cancel     = cancel
+        self.model      = None
+        self.over       = False
+        self.lock       = threading.Lock()
+        threading.Thread(target=self.watch, daemon=True).start()
+
+    def watch(self):
+        while not self.cancel.wait(0.05):
+            if self.over:
+                return
+        with self.lock:
+            if self.model != None:
+                self.model.terminate()
+
+    def started(self, model):
+        with self.lock:
+            if self.cancel.is_set():
+                raise Job_Cancelled()
+            self.model = model
+
+    def finished(self, model):
+        with self.lock:
+            self.model = None
+        if self.cancel.is_set():
+            raise Job_Cancelled()
+
+    def progress(self, sample):
+        self.connection.send(("progress", sample))
+
+
+def work(connection, cancel):
+    #entry point of the worker processes: runs the jobs received until None, sending back their progress and then their result, exception or
+    #cancellation
+    while True:
+        message = connection.recv()
+        if message == None:
+            break
+        kind, args, kwargs = message
+        ilp.watcher        = Job_Watcher(connection, cancel)
+        try:
+            connection.send(("done", TASKS[kind](*args, **kwargs)))
+        except Job_Cancelled:
+            connection.send(("cancelled", None))
+        except Exception as e:
+            connection.send(("error", e))
+        finally:
+            ilp.watcher.over = True
+            ilp.watcher      = None
+    connection.close()
+
+
+class Job:
+    #A computation submitted to a Job_Queue, which is awaited for its result. progress holds the (solve, k, seconds, incumbent, bound, gap, nodes)
+    #samples reported so far by the solves of the job (see ilp.ILP_Result), and state is one of queued, running, done, failed and cancelled
+
+    def __init__(self, queue, kind, args, kwargs, priority, on_progress):
+        self.queue       = queue
+        self.kind        = kind
+        self.args        = args
+        self.kwargs      = kwargs
+        self.priority    = priority
+        self.on_progress = on_progress
+        self.progress    = []
+        self.state       = "queued"
+        self.worker      = None
+        self.future      = asyncio.get_running_loop().create_future()
+
+    def cancel(self):
+        self.queue.cancel(self)
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def __await__(self):
+        return self.future.__await__()
+
+
+class Worker:
+
+    def __init__(self, context):
+        self.connection, child = context.Pipe()
+        self.cancel  = context.Event()
+        self.process = context.Process(target=work, args=(child, self.cancel), daemon=True)
+        self.process.start()
+        child.close()
+        self.job     = None
+
+
+class Job_Queue:
+    #Runs jobs solving the ILPs of ilp.robust and ilp.leastsquares, or computing the safe sequences of a graph with either algorithm, on a fixed number
+    #of worker processes, by increasing priority and then in order of submission. Cancelling a job, directly or when its deadline expires, drops it if
+    #it is still queued, and otherwise terminates its solver, so that its worker takes the next job as soon as the solver stops; a worker still busy
+    #grace seconds later (as one computing safe sequences, which cannot be interrupted) is killed and replaced. The queue is used from a running
+    #event loop:
+    #
+    #    async with Job_Queue(2) as queue:
+    #        job = queue.submit("robust", G, vars_to_fix=P2F, priority=1, deadline=60, on_progress=print)
+    #        result = await job
+
+    def __init__(self, workers, grace=5):
+        self.context  = multiprocessing.get_context('spawn') #a forked child would inherit the solver environment of this process
+        self.workers  = []
+        self.size     = workers
+        self.grace    = grace
+        self.heap     = [] #(priority, number, job) of the queued jobs
+        self.numbers  = itertools.count()
+        self.closed   = False
+
+    async def __aenter__(self):
+        self.loop = asyncio.get_running_loop()
+        for _ in range(self.size):
+            self.spawn()
+        return self
+
+    async def __aexit__(self, *exception):
+        await self.close()
+
+    def spawn(self):
+        worker = Worker(self.context)
+        self.workers.append(worker)
+        self.loop.add_reader(worker.connection.fileno(), self.receive, worker)
+        return worker
+
+    def submit(self, kind, *args, priority=0, deadline=None, on_progress=None, **kwargs) -> Job:
+        #the job running TASKS[kind](*args, **kwargs), where a lower priority runs first. The solves report progress when on_progress(job, sample)
+        #is given, and the job is cancelled after deadline seconds of wall-clock time, spent in the queue or running (unlike the
+        #timeout of the solver, which counts only the time of every solve)
+        if kind not in TASKS:
+            raise ValueError("Unknown job kind '{}'".format(kind))
+        if self.closed:
+            raise RuntimeError("The job queue is closed")
+        if kind in SOLVES and inspect.signature(TASKS[kind]).bind(*args, **kwargs).arguments.get("strategy") == "speculative":
+            raise ValueError("The speculative search starts processes of its own, which the daemonic workers of the job queue cannot")
+        if kind in SOLVES and on_progress != None:
+            kwargs.setdefault("timeline", True)
+        job = Job(self, kind, args, kwargs, priority, on_progress)
+        heapq.heappush(self.heap, (priority, next(self.numbers), job))
+        if deadline != None:
+            self.loop.call_later(deadline, self.expire, job)
+        self.dispatch()
+        return job
+
+    def dispatch(self):
+        for worker in self.workers:
+            while worker.job == None and len(self.heap) > 0:
+                _,_,job = heapq.heappop(self.heap)
+                if job.state != "queued": #cancelled while queued
+                    continue
+                worker.cancel.clear()
+                worker.connection.send((job.kind, job.args, job.kwargs))
+                worker.job, job.worker, job.state = job, worker, "running"
+
+    def receive(self, worker):
+        try:
+            while worker.connection.poll():
+                status, value = worker.connection.recv()
+                job           = worker.job
+                if status == "progress":
+                    job.progress.append(value)
+                    if job.on_progress != None:
+                        job.on_progress(job, value)
+                    continue
+                if status == "done":
+                    self.finish(job, "done", lambda : job.future.set_result(value))
+                elif status == "error":
+                    self.finish(job, "failed", lambda : job.future.set_exception(value))
+                else:
+                    self.finish(job, "cancelled", job.future.cancel)
+                worker.job = None
+        except (EOFError, OSError): #the process died, or was killed by cancel
+            self.replace(worker)
+        self.dispatch()
+
+    def finish(self, job, state, resolve):
+        job.state, job.worker = state, None
+        if not job.future.done():
+            resolve()
+
+    def replace(self, worker):
+        self.loop.remove_reader(worker.connection.fileno())
+        self.workers.remove(worker)
+        worker.process.terminate()
+        worker.process.join()
+        worker.connection.close()
+        job = worker.job
+        if job != None:
+            logger.info("Worker of job {} killed with exit code {}".format(job.kind, worker.process.exitcode))
+            if job.state == "cancelling":
+                self.finish(job, "cancelled", job.future.cancel)
+            else:
+                self.finish(job, "failed", lambda : job.future.set_exception(RuntimeError("The worker process of the {} job exited with code {}".format(job.kind, worker.process.exitcode))))
+        if not self.closed:
+            self.spawn()
+
+    def cancel(self, job):
+        if job.state == "queued":
+            self.finish(job, "cancelled", job.future.cancel)
+        elif job.state == "running":
+            job.state = "cancelling"
+            job.worker.cancel.set()
+            self.loop.call_later(self.grace if job.kind in SOLVES else 0, self.kill, job, job.worker)
+
+    def kill(self, job, worker):
+        if worker.job is job and worker in self.workers:
+            self.replace(worker)
+            self.dispatch()
+
+    def expire(self, job):
+        if not job.done():
+            logger.info("Job {} missed its deadline".format(job.kind))
+            self.cancel(job)
+
+    def status(self) -> dict:
+        return { "queued" : sum( job.state == "queued" for _,_,job in self.heap ), "running" : sum( worker.job != None for worker in self.workers ) }
+
+    async def close(self):
+        #cancels the queued and running jobs and stops the workers
+        self.closed = True
+        for _,_,job in self.heap:
+            if job.state == "queued":
+                self.finish(job, "cancelled", job.future.cancel)
+        for worker in list(self.workers):
+            self.loop.remove_reader(worker.connection.fileno())
+            if worker.job != None:
+                worker.cancel.set()
+                self.finish(worker.job, "cancelled", worker.job.future.cancel)
+            try:
+                worker.connection.send(None)
+            except OSError:
+                pass
+            await self.loop.run_in_executor(None, worker.process.join, self.grace)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+            worker.connection.close()
+        self.workers = []
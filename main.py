@@ -1,14 +1,24 @@
 import os
+import io
+import copy
+import json
+import csv
+import glob
 import random
+import collections
+import itertools
+import multiprocessing
+import concurrent.futures
 import logging
 from datetime import datetime
 import safety
+import stages
+import backends
 import ilp
+import cache
 import time
 import utils
 import argparse
-import numpy as np
-from collections import defaultdict
 
 input_file  = None
 output_file = None
@@ -17,365 +27,671 @@ TIMEOUT     = None
 EPSILON     = None
 VERBOSE     = None
 MODE        = None
-
-random.seed(73)
-current_time = datetime.now()
-dt_day       = current_time.strftime("%d-%m")
-dt_time      = current_time.strftime("%H-%M-%S")
-log_file     = "log_{}_{}.out".format(dt_day,dt_time)
-logging.basicConfig(filename=log_file,format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s', datefmt='%H-%M-%S', level=logging.DEBUG)
-logger       = logging.getLogger(__name__)
-
-
-
-def demo_LQ():
-    
-    graphs = utils.read_graphs(input_file)
-    f      = open("LQ_"+output_file+"_final.out","w")
-    f.write("{}\nThreads:{}, Timeout:{}, Mode:{}\n".format(input_file,THREADS,TIMEOUT,MODE))
+TIGHT       = None
+SYMMETRY    = None
+SOLVER      = None
+SEARCH      = None
+WORKERS     = None
+UNITIGS     = None
+IMPLIED     = None
+BATCH       = None
+CACHE       = None
+TIMELINE    = None
+PORTFOLIO   = None
+CORES       = None
+RESUME      = None
+MODES       = None
+STAGES      = None
+FORMAT      = None
+BUDGET      = None
+ALGORITHM   = None
+
+dt_day      = None
+dt_time     = None
+log_file    = None
+logger      = logging.getLogger(__name__)
+
+
+def configure_logging(filename):
+    #only the entry point configures logging (and seeds random), so that importing this module has no side effects
+    logging.basicConfig(filename=filename,format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s', datefmt='%H-%M-%S', level=logging.DEBUG)
+
+
+
+def write_result(f, label, result):
+    #records the best decomposition found, which is available also when the time limit was hit before proving optimality
+    if result == None:
+        f.write("{:<28}: {}\n".format("status "    + label, None))
+        return
+    f.write("{:<28}: {}\n".format("status "        + label, result.status  ))
+    f.write("{:<28}: {}\n".format("objective "     + label, result.obj     ))
+    f.write("{:<28}: {}\n".format("bound "         + label, result.bound   ))
+    f.write("{:<28}: {}\n".format("gap "           + label, result.gap     ))
+    f.write("{:<28}: {}\n".format("ilp solves "    + label, result.solves  ))
+    f.write("{:<28}: {}\n".format("decomposition " + label, result.solution ))
+    if result.timeline != None:
+        f.write("{:<28}: {}\n".format("first feasible " + label, result.first_feasible()))
+        f.write("{:<28}: {}\n".format("timeline "       + label, result.timeline        ))
+
+
+#the columns of the rows of the results of every graph and mode written with -F, besides the status, objective, bound, gap, number of ILP solves and
+#seconds to the first incumbent (with -T) of both ILPs, as given by result_row
+ROW_FIELDS = ['graph', 'mode', 'n', 'm', 'w', 'solved_default', 'time_default', 'solved_sequences', 'time_sequences', 'preprocess_sequences', 'ilp_time_sequences', 'fixed_vars', 'final_width_default', 'final_width_sequences']
+ROW_FIELDS = ROW_FIELDS + [ field + "_" + label for label in ['default','sequences'] for field in ['status','objective','bound','gap','solves','first_feasible'] ]
+
+
+def result_row(label, result) -> dict:
+    #the columns of result in a row of the results, the counterpart of write_result
+    if result == None:
+        return dict()
+    return { "status_"         + label : result.status,
+             "objective_"      + label : result.obj,
+             "bound_"          + label : result.bound,
+             "gap_"            + label : result.gap,
+             "solves_"         + label : result.solves,
+             "first_feasible_" + label : result.first_feasible() if result.timeline != None else None }
+
+
+def ilp_parameters(label, timeout) -> tuple:
+    #everything besides the graph and the fixed safe sequences that can change the result of an ILP, which keys it in the cache. The threads are left
+    #out, as they do not change the optimum and run_graphs varies them with -j, so that runs on any number of cores share their entries
+    return (label, EPSILON, timeout, TIGHT, SYMMETRY, SOLVER, UNITIGS, IMPLIED, SEARCH, TIMELINE)
+
+
+def cache_lookup(G, label, fixed):
+    #(result, seconds) stored in the cache for G. A result proven optimal is stored without its timeout, which cannot change it, so that it is found
+    #by the runs with any timeout, as those of -B whose timeouts depend on the budget left; a result stopped by the time limit only by the runs with
+    #the same timeout
+    hit = CACHE.get_result(G, ilp_parameters(label, "optimal"), fixed)
+    return hit if hit != None else CACHE.get_result(G, ilp_parameters(label, TIMEOUT), fixed)
+
+
+def timed(solve) -> tuple:
+    start  = time.perf_counter()
+    result = solve()
+    return result, time.perf_counter()-start
+
+
+def cached_result(G, label, fixed, solve) -> tuple:
+    #(result, seconds) of solve(), or those stored in the cache (-d) for a graph isomorphic to G solved with the same parameters and fixed sequences
+    if CACHE != None:
+        hit = cache_lookup(G, label, fixed)
+        if hit != None:
+            logger.info("\tcache hit: {} ILP of graph {}".format(label, G.id))
+            return hit
+    result, seconds = solve()
+    if CACHE != None:
+        CACHE.put_result(G, ilp_parameters(label, "optimal" if result.is_optimal() else TIMEOUT), fixed, result, seconds)
+    return result, seconds
+
+
+def cached_safety(G, label, compute) -> tuple:
+    #(safe sequences, sequences to fix, seconds) with the safe sequences given by compute(), or those stored in the cache (-d)
+    if CACHE != None:
+        hit = CACHE.get_safety(G, label)
+        if hit != None:
+            logger.info("\tcache hit: {} safe sequences of graph {}".format(label, G.id))
+            return hit
+    start            = time.perf_counter()
+    with stages.stage("safety"):
+        safe_seqs    = compute()
+    sequences_to_fix = utils.sequences_to_fix(G, safe_seqs)
+    seconds          = time.perf_counter()-start
+    if CACHE != None:
+        CACHE.put_safety(G, label, safe_seqs, sequences_to_fix, seconds)
+    return safe_seqs, sequences_to_fix, seconds
+
+
+def solve_batches(graphs, batch_solver, label) -> dict:
+    #solves the vanilla ILPs of the graphs selected by -x in batches, returning for each of them its result (or exception) and an even share of the time
+    if BATCH == None:
+        return dict()
+    small = list(filter(lambda G : not utils.is_0_flow_everywhere(G) and ilp.batchable(G, *BATCH), graphs))
+    if CACHE != None: #the graphs already in the cache are not solved again
+        small = list(filter(lambda G : cache_lookup(G, label, []) == None, small))
+    if len(small) == 0:
+        return dict()
+    start   = time.time()
+    results = batch_solver(small, epsilon=EPSILON, timeout=TIMEOUT, threads=THREADS, tight_bounds=TIGHT, symmetry=SYMMETRY, backend=SOLVER, unitigs=UNITIGS)
+    share   = (time.time()-start)/len(small)
+    logger.info("Solved {} graphs in batches".format(len(small)))
+    return { G.id : (result, share) for G,result in zip(small, results) }
+
+
+def batched_result(batch) -> tuple:
+    #(result, seconds) of a graph solved in a batch by solve_batches
+    result,share = batch
+    if isinstance(result, Exception):
+        raise result
+    return result, share
+
+
+def graph_mode(G, total, batch, shared, mode):
+    #The pipeline of one graph in the given mode, see DEMOS: zero-flow filter, safety (the safe sequences, their coverage of the arcs and a maximum
+    #weight edge antichain, unless shared already holds them with their seconds), and the vanilla ILP and the one fixing the safe sequences of the
+    #antichain, each encoded, solved and extracted. Returns the results block of the graph and its row (None for the graphs skipped), and every
+    #stage reports to the active stages timer
+    prefix,label,formulation,batch_solver,optimize,kind = DEMOS[mode]
+
+    f = io.StringIO()
 
     t_rb_seqs_heur    = 0
     t_safe_seqs_heur  = 0
     t_ilp_seqs_heur   = 0
     solved_seqs_heur  = 0
     fixed_vars_s      = 0
+    w_van             = 0
+    w_seqs            = 0
 
-    for G in graphs:
+    print("__demo_final__ Running on " + str(G.id) + "/" + str(total) + " with n=" + str(G.n) + ", m=" + str(G.m) + " and w=" + str(G.w))
 
-        print("__demo_final__ Running on " + str(G.id) + "/" + str(len(graphs)) + " with n=" + str(G.n) + ", m=" + str(G.m) + " and w=" + str(G.w))
+    with stages.stage("filter"):
+        zero_flow = utils.is_0_flow_everywhere(G)
+    if zero_flow:
+        logger.info("Found 0 flow everywhere, skipping graph " + str(G.id))
+        return "", None
 
-        if utils.is_0_flow_everywhere(G):
-            logger.info("Found 0 flow everywhere, skipping graph " + str(G.id))
-            continue
+    f.write("#Graph {}\n{}, {}, {}\n".format(G.id,G.n,G.m,G.w))
+    
+    logger.info("   Starting demo on graph \'{}\' with id {}".format(input_file,G.id))
+
+    res1  = None
+    res2  = None
+    solve = lambda fixed, implied, lazy : timed(lambda : formulation(G, epsilon=EPSILON, timeout=TIMEOUT, threads=THREADS, vars_to_fix=fixed, path_constraints=implied, lazy=lazy, optimize=optimize, tight_bounds=TIGHT, symmetry=SYMMETRY, backend=SOLVER, strategy=SEARCH, workers=WORKERS, unitigs=UNITIGS, timeline=TIMELINE))
+
+    #Vanilla
+    try:
+        with stages.stage("default"):
+            res1, t_rb_default = cached_result(G, label, [], lambda : batched_result(batch) if batch != None else solve([], [], False))
+        w_van          = res1.k
+        solved_default = res1.is_optimal()
+    except (utils.GRB_TimeOut, utils.GRB_Infeasible) as e:
+        logger.info("\t{}. Graph {} in dataset \'{}\' in vanilla mode.".format(e,G.id,input_file))
+        t_rb_default   = 0
+        solved_default = False
+        w_van          = -1
+    logger.info("\tvanilla: {}, {}, {}".format(solved_default,t_rb_default, w_van) )
+
+
+    try:
+        safe_seqs, sequences_to_fix, t_safe_seqs_heur = shared if shared != None else cached_safety(G, kind, lambda : SAFETY[kind](G))
+        sequences_to_imply = utils.sequences_to_imply(safe_seqs, sequences_to_fix) if IMPLIED else []
+
+        with stages.stage("sequences"):
+            res2, t_ilp_seqs_heur = cached_result(G, label + " sequences", sequences_to_fix, lambda : solve(sequences_to_fix, sequences_to_imply, IMPLIED=='lazy'))
+        w_seqs           = res2.k
+
+        t_rb_seqs_heur   = t_safe_seqs_heur + t_ilp_seqs_heur
+        solved_seqs_heur = res2.is_optimal()
+        fixed_vars_s     = sum(map(lambda sequence : len(sequence), sequences_to_fix))
+    
+    except (utils.GRB_TimeOut, utils.GRB_Infeasible) as e:
+        logger.info("\t{}. Graph {} in dataset \'{}\' with fixing subsequence constraints.".format(e,G.id,input_file))
+        t_rb_seqs_heur = t_ilp_seqs_heur = 0
+        solved_seqs_heur                 = False
+        w_seqs                           = -1
+        fixed_vars_s = t_safe_seqs_heur  = 0
+    logger.info("\tfixing safe sequences: {}, {} , {}, {}, {}, {}".format(solved_seqs_heur, t_rb_seqs_heur, t_safe_seqs_heur, t_ilp_seqs_heur, fixed_vars_s, w_seqs) )
+
+    if not optimize and res1!=None and res1.is_optimal(): #the optimized numbers of paths may differ, and so the objectives
+        if res2==None or not res2.is_optimal():
+            print("Safety lost against vanilla " + label)
+            logger.info("\t\t: " + label + ": Safety lost against vanilla on graph " + str(G.id))
+        else:
+            if (res1.obj!=res2.obj):
+                #print(res1.obj,res2.obj)
+                print("\nPROBLEM\n")
+
+    f.write("solved default              : {}\n".format(solved_default              ))
+    f.write("total time default          : {}\n".format('%.6f' % t_rb_default       ))
+    f.write("solved sequences heur       : {}\n".format(solved_seqs_heur            ))
+    f.write("total time sequences heur   : {}\n".format('%.6f' % t_rb_seqs_heur     ))
+    f.write("preprocess sequences heur   : {}\n".format('%.6f' % t_safe_seqs_heur   ))
+    f.write("ilp time seqs heur          : {}\n".format('%.6f' % t_ilp_seqs_heur    ))
+    f.write("fixed vars seqs             : {}\n".format(fixed_vars_s                ))
+    if optimize:
+        f.write("final width default         : {}\n".format(w_van                       ))
+        f.write("final width sequences       : {}\n".format(w_seqs                      ))
+    write_result(f, "default"        , res1)
+    write_result(f, "sequences heur" , res2)
 
-        f.write("#Graph {}\n{}, {}, {}\n".format(G.id,G.n,G.m,G.w))
-        
-        logger.info("   Starting demo on graph \'{}\' with id {}".format(input_file,G.id))
+    row = dict(graph=G.id, mode=mode, n=G.n, m=G.m, w=G.w, solved_default=solved_default, time_default=t_rb_default, solved_sequences=solved_seqs_heur,
+               time_sequences=t_rb_seqs_heur, preprocess_sequences=t_safe_seqs_heur, ilp_time_sequences=t_ilp_seqs_heur, fixed_vars=fixed_vars_s,
+               final_width_default=w_van if optimize else None, final_width_sequences=w_seqs if optimize else None)
+    row.update(result_row("default", res1))
+    row.update(result_row("sequences", res2))
 
-        obj1=None
-        obj2=None
+    return f.getvalue(), row
 
-        #Vanilla
-        try:
-            start  = time.time()
-            obj1   = ilp.leastsquares(G, epsilon=EPSILON, timeout=TIMEOUT, threads=THREADS)
-            end    = time.time()
-            t_rb_default   = end-start
-            solved_default = True
-        except utils.GRB_TimeOut as e:
-            logger.info("\t{}. Graph {} in dataset \'{}\' in vanilla mode.".format(e,G.id,input_file))
-            t_rb_default   = 0
-            solved_default = False
-        except utils.GRB_Infeasible as e:
-            logger.info("\t{}. Graph {} in dataset \'{}\' in vanilla mode.".format(e,G.id,input_file))
-            t_rb_default   = 0
-            solved_default = False
-        logger.info("\tvanilla: {}, {}".format(solved_default,t_rb_default) )
 
+def solve_threads(G) -> int:
+    #Threads of every solve of G in the parallel runner: one for small encodings, on which more threads only add overhead, and then one more for every
+    #further 2000 arc variables (m*w), up to -t
+    return max(1, min(THREADS, CORES, G.m * G.w // 2000 + 1))
 
-        try:
-            #X = set( filter( lambda edge : G.flow[edge] >= np.percentile(list(G.flow.values()), 25), G.edge_list) )
-            X = set(G.edge_list)
-            t0        = time.time()
-
-            safe_seqs = safety.maximal_safe_sequences_via_dominators(G, X)
-
-            longest_safe_sequence = dict()
-            len_of_longest_ss     = defaultdict(lambda:0)
-            for i in range(len(safe_seqs)):
-                safe_seq = safe_seqs[i]
-                length = len(safe_seq)
-                for edge in safe_seq:
-                    if edge not in longest_safe_sequence:
-                        longest_safe_sequence[edge] = i
-                        len_of_longest_ss[edge]     = length
-                    elif len(safe_seqs[longest_safe_sequence[edge]]) < length:
-                        longest_safe_sequence[edge] = i
-                        len_of_longest_ss[edge]     = length
-
-            _, edge_antichain = utils.max_edge_antichain(G, get_antichain=True, weight_function=len_of_longest_ss)
-            sequences_to_fix  = list(map(lambda edge : safe_seqs[longest_safe_sequence[edge]] , edge_antichain))
-
-            t1   = time.time()
-            obj2 = ilp.leastsquares(G, epsilon=EPSILON, timeout=TIMEOUT, threads=THREADS, vars_to_fix=sequences_to_fix)
-            t2   = time.time()
-
-            t_rb_seqs_heur   = t2-t0
-            t_safe_seqs_heur = t1 - t0
-            t_ilp_seqs_heur  = t2-t1
-            solved_seqs_heur = True
-            fixed_vars_s     = sum(map(lambda sequence : len(sequence), sequences_to_fix))
-        
-        except utils.GRB_TimeOut as e:
-            logger.info("\t{}. Graph {} in dataset \'{}\' with fixing subsequence constraints.".format(e,G.id,input_file))
-            t_rb_seqs_heur = t_ilp_seqs_heur = 0
-            solved_seqs_heur                 = False
-            fixed_vars_s = t_safe_seqs_heur  = 0
-        except utils.GRB_Infeasible as e:
-            logger.info("\t{}. Graph {} in dataset \'{}\' with fixing subsequence constraints.".format(e,G.id,input_file))
-            t_rb_seqs_heur = t_ilp_seqs_heur = 0
-            solved_seqs_heur                 = False
-            fixed_vars_s = t_safe_seqs_heur  = 0
-        logger.info("\tfixing safe sequences: {}, {} , {}, {}, {}".format(solved_seqs_heur, t_rb_seqs_heur, t_safe_seqs_heur, t_ilp_seqs_heur, fixed_vars_s) )
-
-        if obj1!=None:
-            if obj2==None:
-                print("Safety lost against vanilla LQ")
-                logger.info("\t\t: LQ: Safety lost against vanilla on graph " + str(G.id))
-            else:
-                if (obj1!=obj2):
-                    #print(obj1,obj2)
-                    print("\nPROBLEM\n")
-
-        f.write("solved default              : {}\n".format(solved_default              ))
-        f.write("total time default          : {}\n".format('%.6f' % t_rb_default       ))
-        f.write("solved sequences heur       : {}\n".format(solved_seqs_heur            ))
-        f.write("total time sequences heur   : {}\n".format('%.6f' % t_rb_seqs_heur     ))
-        f.write("preprocess sequences heur   : {}\n".format('%.6f' % t_safe_seqs_heur   ))
-        f.write("ilp time seqs heur          : {}\n".format('%.6f' % t_ilp_seqs_heur    ))
-        f.write("fixed vars seqs             : {}\n".format(fixed_vars_s                ))
 
-    f.close()
-    return
+def configure_worker(settings):
+    #initializer of the processes of run_graphs, which do not inherit the settings of main when they are spawned instead of forked
+    globals().update(settings)
+    configure_logging(log_file) #forked processes keep the logging of main
 
 
+def solve_in_worker(solve_graph, G, total, batch, threads, timeout):
+    global THREADS
+    global TIMEOUT
+    THREADS = threads
+    TIMEOUT = timeout
+    return solve_graph(G, total, batch)
 
-def demo_RB():
-    
-    graphs = utils.read_graphs(input_file)
-    f      = open("RB_"+output_file+"_final.out","w")
-    f.write("{}\nThreads:{}, Timeout:{}, Mode:{}\n".format(input_file,THREADS,TIMEOUT,MODE))
 
-    t_rb_seqs_heur    = 0
-    t_safe_seqs_heur  = 0
-    t_ilp_seqs_heur   = 0
-    solved_seqs_heur  = 0
-    fixed_vars_s      = 0
+def run_graphs(graphs, solve_graph, batched, timeout_of=None):
+    #Yields solve_graph(G, total, batch) of every graph in the order of graphs, where batch is the result of G in batched, if any, and every ILP gets
+    #the timeout_of(G, graphs left) seconds decided when the graph is started, if given. With -j CORES the graphs are solved in parallel processes that
+    #share the cores: every graph is started as soon as the solve_threads(G) threads it needs are free, and the results are yielded in order as soon as
+    #all the previous ones are done
+    global TIMEOUT
+    timeout    = TIMEOUT
+    timeout_of = timeout_of if timeout_of != None else lambda G, left : timeout
+    if CORES == None:
+        try:
+            for index,G in enumerate(graphs):
+                yield solve_in_worker(solve_graph, G, len(graphs), batched.get(G.id), THREADS, timeout_of(G, len(graphs)-index))
+        finally:
+            TIMEOUT = timeout
+        return
+
+    context  = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+    settings = { name : globals()[name] for name in ['log_file','dt_day','dt_time','input_file','THREADS','TIMEOUT','EPSILON','VERBOSE','MODE','TIGHT','SYMMETRY','SOLVER','SEARCH','WORKERS','UNITIGS','IMPLIED','BATCH','CACHE','TIMELINE','PORTFOLIO','CORES','MODES','STAGES','FORMAT'] }
+    running  = dict() #future -> (index, threads)
+    done     = dict() #index -> result
+    free     = CORES
+    next_out = 0
+
+    def collect(): #waits for at least one graph to finish
+        nonlocal free
+        finished,_ = concurrent.futures.wait(list(running), return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in finished:
+            index,threads = running.pop(future)
+            done[index]   = future.result()
+            free         += threads
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=CORES, mp_context=context, initializer=configure_worker, initargs=(settings,)) as executor:
+        for index,G in enumerate(graphs):
+            threads = solve_threads(G)
+            while free < threads:
+                collect()
+                while next_out in done:
+                    yield done.pop(next_out)
+                    next_out += 1
+            future          = executor.submit(solve_in_worker, solve_graph, G, len(graphs), batched.get(G.id), threads, timeout_of(G, len(graphs)-index))
+            running[future] = (index, threads)
+            free           -= threads
+        while len(running) > 0 or next_out in done:
+            if next_out not in done:
+                collect()
+            while next_out in done:
+                yield done.pop(next_out)
+                next_out += 1
+
+
+class Results_File:
+    #The results file of a demo. The block of every graph is flushed to it as soon as the graph is done, and then checkpointed by a line "id<TAB>offset"
+    #in path.done, where offset is the size of the file after the block. With --resume, the results file of the last run of the demo on the same input
+    #(or the one named by -o) is reopened after its last checkpoint, dropping any block cut by a crash, and its finished graphs are not read again.
+    #With records=True, the stage records of the graphs are written as JSON lines to path.stages.jsonl and, with rows 'jsonl' or 'csv', their rows
+    #(see ROW_FIELDS) to path.jsonl or path.csv, before their checkpoints
+
+    def __init__(self, prefix, header, records=False, rows=None):
+        self.path     = prefix + output_file + "_final.out"
+        self.finished = dict() #graph id -> offset
+        self.records  = None
+        self.rows     = None
+        if RESUME and output_file.endswith(dt_day + "_" + dt_time): #the name has the time of this run, so we look for the last run
+            previous = glob.glob(glob.escape(prefix + input_file.replace("/","_")) + "_*_final.out")
+            if len(previous) > 0:
+                self.path = max(previous, key=os.path.getmtime)
+        if RESUME and os.path.exists(self.path) and os.path.exists(self.path + ".done"):
+            with open(self.path + ".done") as done:
+                for line in done:
+                    if line.endswith("\n"): #a line cut by a crash is not a checkpoint
+                        id,offset = line[:-1].rsplit("\t", 1)
+                        self.finished[id] = int(offset)
+
+        if len(self.finished) > 0:
+            os.truncate(self.path, max(self.finished.values()))
+            self.f    = open(self.path, "a")
+            self.done = open(self.path + ".done", "w")
+            for id,offset in self.finished.items():
+                self.done.write("{}\t{}\n".format(id, offset))
+            logger.info("Resuming {} after {} finished graphs".format(self.path, len(self.finished)))
+        else:
+            self.f    = open(self.path, "w")
+            self.done = open(self.path + ".done", "w")
+            self.f.write(header)
+
+        if records:
+            self.records   = self.reopen(self.path + ".stages.jsonl", lambda line : json.loads(line)["graph"])
+        if rows == 'jsonl':
+            self.rows      = self.reopen(self.path + ".jsonl", lambda line : json.loads(line)["graph"])
+            self.write_row = lambda row : self.rows.write(json.dumps(row) + "\n")
+        elif rows == 'csv':
+            self.rows      = self.reopen(self.path + ".csv", lambda line : next(csv.reader([line]))[0], header=True)
+            writer         = csv.DictWriter(self.rows, ROW_FIELDS)
+            self.write_row = writer.writerow
+            if self.rows.tell() == 0:
+                writer.writeheader()
+        self.sync()
+
+    def reopen(self, path, graph_of, header=False):
+        #opens the file path of lines about single graphs, keeping the lines of the finished graphs (and the first line, with header=True) when resuming
+        kept = []
+        if len(self.finished) > 0 and os.path.exists(path):
+            with open(path) as previous:
+                lines = list(filter(lambda line : line.endswith("\n"), previous))
+            kept = lines[:1] if header else []
+            kept = kept + list(filter(lambda line : graph_of(line) in self.finished, lines[len(kept):]))
+        f = open(path, "w")
+        f.writelines(kept)
+        return f
+
+    def sync(self):
+        for f in filter(lambda f : f != None, [self.f, self.done, self.records, self.rows]):
+            f.flush()
+            os.fsync(f.fileno())
+
+    def write(self, G, block, row=None, record=None):
+        if self.rows != None and row != None:
+            self.write_row(row)
+        if self.records != None and record != None:
+            self.records.write(json.dumps(record) + "\n")
+        self.f.write(block)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.done.write("{}\t{}\n".format(G.id, self.f.tell()))
+        self.sync()
+
+    def close(self):
+        for f in filter(lambda f : f != None, [self.f, self.done, self.records, self.rows]):
+            f.close()
+
+
+def header(mode) -> str:
+    if mode == '2':
+        return "{}\nThreads:{}, Timeout:{}, Mode:{}, Epsilon:{}, Search:{}\n".format(input_file,THREADS,TIMEOUT,mode,EPSILON,SEARCH)
+    return "{}\nThreads:{}, Timeout:{}, Mode:{}\n".format(input_file,THREADS,TIMEOUT,mode)
+
+
+#for every mode, the prefix of its results file, the label of its ILPs (in the log and the cache), the formulation, the batch solver of its vanilla
+#ILPs, whether it optimizes the number of paths, and the algorithm of its safe sequences in SAFETY
+DEMOS  = { '0' : ("RB_"    , "RB"         , ilp.robust      , ilp.robust_batch      , False, "dominators"),
+           '1' : ("LQ_"    , "LQ"         , ilp.leastsquares, ilp.leastsquares_batch, False, "dominators"),
+           '2' : ("OPT_RB_", "optimize RB", ilp.robust      , None                  , True , "maximal"   ) }
+
+#X = set( filter( lambda edge : G.flow[edge] >= np.percentile(list(G.flow.values()), 25), G.edge_list) )
+SAFETY = { "dominators" : lambda G : safety.maximal_safe_sequences_via_dominators(G, set(G.edge_list)),
+           "maximal"    : lambda G : safety.maximal_safe_sequences(G, G.edge_list) }
+
+
+def shared_safety(G) -> dict:
+    #algorithm -> ((safe sequences, sequences to fix, seconds), stages timer) of G for every algorithm of the modes of MODES, each computed once for
+    #all the modes using it, and timed on its own copy of the timer of G (holding its parse stage)
+    shared = dict()
+    for kind in dict.fromkeys( DEMOS[mode][5] for mode in MODES ):
+        timer = copy.deepcopy(G.timer)
+        with stages.activate(timer):
+            shared[kind] = (cached_safety(G, kind, lambda : SAFETY[kind](G)), timer)
+    return shared
+
+
+def graph_modes(G, total, batches):
+    #the results blocks of one graph in every mode of MODES, each with its row and the record of its stages. The safe sequences and the antichain of
+    #every mode are those of its algorithm in shared_safety, unless already in G.safety, and their stages, like the parse stage, are attributed to
+    #every mode using them
+    shared = getattr(G, "safety", None)
+    if shared == None and not utils.is_0_flow_everywhere(G):
+        shared = shared_safety(G)
+    batches = batches if batches != None else dict()
+    results = []
+    for mode in MODES:
+        safety,timer = shared[DEMOS[mode][5]] if shared != None else (None, G.timer)
+        timer        = copy.deepcopy(timer)
+        with stages.activate(timer):
+            block,row = graph_mode(G, total, batches.get(mode), safety, mode)
+        results.append( (block, row, dict(graph=G.id, mode=mode, n=G.n, m=G.m, w=G.w, **timer.record())) )
+    return results
+
+
+class Budget:
+    #The total wall-clock budget of -B for the graphs of a demo. The graphs are solved from the easiest to the hardest predicted one: by the number of
+    #arc variables of their ILPs (m*w) not fixed by their safe sequences, and then by their number of vertices. Every ILP gets an even share of the
+    #time left for the ILPs of the graphs still to solve (times the graphs solved at once with -j), of at most -g seconds and at least one second, so
+    #that the time not used by the easy graphs goes to the hard ones. The graphs with an ILP not solved to optimality are solved again at the end, if
+    #their share of the time left is then larger than their first one
+
+    def __init__(self, seconds):
+        self.deadline = time.perf_counter() + seconds
+        self.limit    = TIMEOUT
+        self.timeouts = dict() #graph id -> seconds of every ILP of its last solve
+
+    def difficulty(self, G) -> tuple:
+        fixed = sum(map(len, G.safety[DEMOS[MODES[0]][5]][0][1])) if getattr(G, "safety", None) != None else 0
+        return (G.m * G.w - fixed, G.n)
+
+    def order(self, graphs) -> list:
+        #the graphs from the easiest, whose safe sequences are computed here to predict their difficulty, and then kept in G.safety for all the modes
+        for G in graphs:
+            if not utils.is_0_flow_everywhere(G):
+                G.safety = shared_safety(G)
+        return sorted(graphs, key=self.difficulty)
+
+    def share(self, G, left) -> float:
+        lanes = CORES // solve_threads(G) if CORES != None else 1
+        return max(0, self.deadline - time.perf_counter()) * max(1, lanes) / (left * 2 * len(MODES))
+
+    def timeout(self, G, left) -> float:
+        self.timeouts[G.id] = max(1, min(self.limit, self.share(G, left)))
+        logger.info("Budget: {:.1f} seconds per ILP of graph {}".format(self.timeouts[G.id], G.id))
+        return self.timeouts[G.id]
+
+    def unsolved(self, results) -> bool:
+        return any( row != None and not (row['solved_default'] and row['solved_sequences']) for block,row,record in results )
+
+    def revisit(self, graphs) -> list:
+        #the graphs given a longer timeout than their first one by the time left
+        return list(filter(lambda G : min(self.limit, self.share(G, len(graphs))) > self.timeouts[G.id], graphs))
+
+
+def demo_modes():
+    #Runs the demos of every mode of MODES in a single pass over the input: every graph is read, and its width is computed, only once, and its safe
+    #sequences and antichain once per algorithm (modes 0 and 1 use dominators and mode 2 the maximal safe sequences). Every mode writes its own
+    #results file, reporting the shared preprocessing time of its algorithm as its own, as a run of that mode alone
+    files    = { mode : Results_File(DEMOS[mode][0], header(mode), STAGES != None, FORMAT) for mode in MODES }
+    finished = set.intersection(*[ set(f.finished) for f in files.values() ])
+    graphs   = utils.read_graphs(input_file, CACHE, finished, timed=True, memory=STAGES=='memory')
+    batched  = dict() #graph id -> mode -> batch result
+    for mode in MODES:
+        prefix,label,formulation,batch_solver,optimize,kind = DEMOS[mode]
+        if batch_solver != None:
+            for id,batch in solve_batches(graphs, batch_solver, label).items():
+                batched.setdefault(id, dict())[mode] = batch
+
+    def write(G, results):
+        for mode,(block,row,record) in zip(MODES, results):
+            if G.id not in files[mode].finished:
+                files[mode].write(G, block, row, record)
+
+    budget = Budget(BUDGET) if BUDGET != None else None
+    if budget != None:
+        graphs = budget.order(graphs)
+    held   = dict() #graph id -> (G, results) of the graphs to solve again, which are written at the end
+    for G,results in zip(graphs, run_graphs(graphs, graph_modes, batched, budget.timeout if budget != None else None)):
+        if budget != None and budget.unsolved(results):
+            held[G.id] = (G, results)
+        else:
+            write(G, results)
+
+    if len(held) > 0:
+        revisit = budget.revisit([ G for G,results in held.values() ])
+        logger.info("Budget: solving again {} of {} graphs not solved to optimality".format(len(revisit), len(held)))
+        for G,results in zip(revisit, run_graphs(revisit, graph_modes, batched, budget.timeout)):
+            held[G.id] = (G, results)
+        for G,results in held.values():
+            write(G, results)
+
+    for f in files.values():
+        f.close()
+    return
 
-    for G in graphs:
 
-        print("__demo_final__ Running on " + str(G.id) + " out of " + str(len(graphs)) + " with n=" + str(G.n) + ", m=" + str(G.m) + " and w=" + str(G.w))
+def graph_portfolio(G, total, batch):
+    #the results block of one graph, see demo_portfolio
 
-        if utils.is_0_flow_everywhere(G):
-            logger.info("Found 0 flow everywhere, skipping graph " + str(G.id))
-            continue
+    f = io.StringIO()
 
-        f.write("#Graph {}\n{}, {}, {}\n".format(G.id,G.n,G.m,G.w))
-        
-        logger.info("   Starting demo on graph \'{}\' with id {}".format(input_file,G.id))
+    print("__demo_final__ Running on " + str(G.id) + "/" + str(total) + " with n=" + str(G.n) + ", m=" + str(G.m) + " and w=" + str(G.w))
 
-        obj1 = None
-        obj2 = None
+    if utils.is_0_flow_everywhere(G):
+        logger.info("Found 0 flow everywhere, skipping graph " + str(G.id))
+        return "", None
 
-        #Vanilla
-        try:
-            start  = time.time()
-            obj1   = ilp.robust(G, epsilon=EPSILON, timeout=TIMEOUT, threads=THREADS)
-            end    = time.time()
-            t_rb_default   = end-start
-            solved_default = True
-        except utils.GRB_TimeOut as e:
-            logger.info("\t{}. Graph {} in dataset \'{}\' in vanilla mode.".format(e,G.id,input_file))
-            t_rb_default   = 0
-            solved_default = False
-        except utils.GRB_Infeasible as e:
-            logger.info("\t{}. Graph {} in dataset \'{}\' in vanilla mode.".format(e,G.id,input_file))
-            t_rb_default   = 0
-            solved_default = False
-        logger.info("\tvanilla: {}, {}".format(solved_default,t_rb_default) )
+    f.write("#Graph {}\n{}, {}, {}\n".format(G.id,G.n,G.m,G.w))
 
+    logger.info("   Starting portfolio on graph \'{}\' with id {}".format(input_file,G.id))
 
-        try:
-            #X = set( filter( lambda edge : G.flow[edge] >= np.percentile(list(G.flow.values()), 25), G.edge_list) )
-            X = set(G.edge_list)
-            t0        = time.time()
-
-            safe_seqs = safety.maximal_safe_sequences_via_dominators(G, X)
-
-            longest_safe_sequence = dict()
-            len_of_longest_ss     = defaultdict(lambda:0)
-            for i in range(len(safe_seqs)):
-                safe_seq = safe_seqs[i]
-                length = len(safe_seq)
-                for edge in safe_seq:
-                    if edge not in longest_safe_sequence:
-                        longest_safe_sequence[edge] = i
-                        len_of_longest_ss[edge]     = length
-                    elif len(safe_seqs[longest_safe_sequence[edge]]) < length:
-                        longest_safe_sequence[edge] = i
-                        len_of_longest_ss[edge]     = length
-
-            _, edge_antichain = utils.max_edge_antichain(G, get_antichain=True, weight_function=len_of_longest_ss)
-            
-            sequences_to_fix  = list(map(lambda edge : safe_seqs[longest_safe_sequence[edge]] , edge_antichain))
-
-            t1   = time.time()
-            obj2 = ilp.robust(G, epsilon=EPSILON, timeout=TIMEOUT, threads=THREADS, vars_to_fix=sequences_to_fix)
-            t2   = time.time()
-
-            t_rb_seqs_heur   = t2-t0
-            t_safe_seqs_heur = t1-t0
-            t_ilp_seqs_heur  = t2-t1
-            solved_seqs_heur = True
-            fixed_vars_s     = sum(map(lambda sequence : len(sequence), sequences_to_fix))
-        
-        except utils.GRB_TimeOut as e:
-            logger.info("\t{}. Graph {} in dataset \'{}\' with fixing subsequence constraints.".format(e,G.id,input_file))
-            t_rb_seqs_heur = t_ilp_seqs_heur = 0
-            solved_seqs_heur                 = False
-            fixed_vars_s = t_safe_seqs_heur  = 0
-        except utils.GRB_Infeasible as e:
-            logger.info("\t{}. Graph {} in dataset \'{}\' with fixing subsequence constraints.".format(e,G.id,input_file))
-            t_rb_seqs_heur = t_ilp_seqs_heur = 0
-            solved_seqs_heur                 = False
-            fixed_vars_s = t_safe_seqs_heur  = 0
-        logger.info("\tfixing safe sequences: {}, {} , {}, {}, {}".format(solved_seqs_heur, t_rb_seqs_heur, t_safe_seqs_heur, t_ilp_seqs_heur, fixed_vars_s) )
-
-        if obj1!=None:
-            if obj2==None:
-                print("Safety lost against vanilla RB")
-                logger.info("\t\t: RB: Safety lost against vanilla on graph " + str(G.id))
-            else:
-                if (obj1!=obj2):
-                    #print(obj1,obj2)
-                    print("\nPROBLEM\n")
-
-        f.write("solved default              : {}\n".format(solved_default              ))
-        f.write("total time default          : {}\n".format('%.6f' % t_rb_default       ))
-        f.write("solved sequences heur       : {}\n".format(solved_seqs_heur            ))
-        f.write("total time sequences heur   : {}\n".format('%.6f' % t_rb_seqs_heur     ))
-        f.write("preprocess sequences heur   : {}\n".format('%.6f' % t_safe_seqs_heur   ))
-        f.write("ilp time seqs heur          : {}\n".format('%.6f' % t_ilp_seqs_heur    ))
-        f.write("fixed vars seqs             : {}\n".format(fixed_vars_s                ))
+    result = None
+    winner = None
+    t_safe = 0
+    t_race = 0
 
-    f.close()
-    return
+    try:
+        safe_seqs, sequences_to_fix, t_safe = cached_safety(G, "dominators", lambda : safety.maximal_safe_sequences_via_dominators(G, set(G.edge_list)))
+        configurations = ilp.portfolio_configurations(PORTFOLIO, sequences_to_fix, utils.sequences_to_imply(safe_seqs, sequences_to_fix))
 
+        start          = time.time()
+        winner, result = (ilp.leastsquares_portfolio if MODE == '1' else ilp.robust_portfolio)(G, configurations, epsilon=EPSILON, timeout=TIMEOUT, threads=THREADS, optimize=MODE=='2', tight_bounds=TIGHT, symmetry=SYMMETRY, backend=SOLVER, strategy=SEARCH, lazy=IMPLIED=='lazy', timeline=TIMELINE)
+        t_race         = time.time()-start
+    except utils.GRB_TimeOut as e:
+        logger.info("\t{}. Graph {} in dataset \'{}\' in portfolio mode.".format(e,G.id,input_file))
+    except utils.GRB_Infeasible as e:
+        logger.info("\t{}. Graph {} in dataset \'{}\' in portfolio mode.".format(e,G.id,input_file))
+    logger.info("\tportfolio: {}, {}, {}".format(winner, t_safe, t_race) )
 
-def demo_optimize_RB():
-    
-    graphs = utils.read_graphs(input_file)
-    f      = open("OPT_RB_"+output_file+"_final.out","w")
-    f.write("{}\nThreads:{}, Timeout:{}, Mode:{}, Epsilon:{}\n".format(input_file,THREADS,TIMEOUT,MODE,EPSILON))
+    f.write("portfolio winner            : {}\n".format(winner                      ))
+    f.write("preprocess safety           : {}\n".format('%.6f' % t_safe             ))
+    f.write("total time portfolio        : {}\n".format('%.6f' % t_race             ))
+    write_result(f, "portfolio", result)
 
-    t_rb_seqs_heur    = 0
-    t_safe_seqs_heur  = 0
-    t_ilp_seqs_heur   = 0
-    solved_seqs_heur  = 0
-    fixed_vars_s      = 0
-    w_van             = 0
-    w_paths           = 0
-    w_seqs            = 0
+    return f.getvalue(), winner
 
-    for G in graphs:
 
-        print("__demo_final__ Running on " + str(G.id) + "/" + str(len(graphs)) + " with n=" + str(G.n) + ", m=" + str(G.m) + " and w=" + str(G.w))
+def demo_portfolio():
+    #races the configurations of -P on every graph with the formulation of the mode, keeping the first proven optimum and recording its configuration
 
-        if utils.is_0_flow_everywhere(G):
-            logger.info("Found 0 flow everywhere, skipping graph " + str(G.id))
-            continue
+    f      = Results_File("PF_", "{}\nThreads:{}, Timeout:{}, Mode:{}, Portfolio:{}\n".format(input_file,THREADS,TIMEOUT,MODE,",".join(PORTFOLIO)))
+    graphs = utils.read_graphs(input_file, CACHE, f.finished)
+    wins   = dict()
 
-        f.write("#Graph {}\n{}, {}, {}\n".format(G.id,G.n,G.m,G.w))
-        
-        logger.info("   Starting demo on graph \'{}\' with id {}".format(input_file,G.id))
+    with open(f.path) as previous: #the winners of the graphs finished by the run that is resumed
+        for line in previous:
+            if line.startswith("portfolio winner") and line.split(":",1)[1].strip() != "None":
+                winner       = line.split(":",1)[1].strip()
+                wins[winner] = wins.get(winner, 0) + 1
 
-        #Vanilla
-        try:
-            start  = time.time()
-            w_van  = ilp.robust(G, epsilon=EPSILON, timeout=TIMEOUT, threads=THREADS, optimize=True)
-            end    = time.time()
-            t_rb_default   = end-start
-            solved_default = True
-        except utils.GRB_TimeOut as e:
-            logger.info("\t{}. Graph {} in dataset \'{}\' in vanilla mode.".format(e,G.id,input_file))
-            t_rb_default   = 0
-            solved_default = False
-            w_van          = -1
-        except utils.GRB_Infeasible as e:
-            logger.info("\t{}. Graph {} in dataset \'{}\' in vanilla mode.".format(e,G.id,input_file))
-            t_rb_default   = 0
-            solved_default = False
-            w_van          = -1
-        logger.info("\tvanilla: {}, {}, {}".format(solved_default,t_rb_default, w_van) )
+    for G,(block,winner) in zip(graphs, run_graphs(graphs, graph_portfolio, dict())):
+        f.write(G, block)
+        if winner != None:
+            wins[winner] = wins.get(winner, 0) + 1
 
-
-        try:
-            start        = time.time()
-
-            safe_seqs    = safety.maximal_safe_sequences(G, G.edge_list)
-
-            longest_safe_sequence = dict()
-            len_of_longest_ss     = dict()
-            for i in range(len(safe_seqs)):
-                safe_seq = safe_seqs[i]
-                length = len(safe_seq)
-                for edge in safe_seq:
-                    if edge not in longest_safe_sequence:
-                        longest_safe_sequence[edge] = i
-                        len_of_longest_ss[edge]     = length
-                    elif len(safe_seqs[longest_safe_sequence[edge]]) < length:
-                        longest_safe_sequence[edge] = i
-                        len_of_longest_ss[edge]     = length
-
-            _, edge_antichain = utils.max_edge_antichain(G, get_antichain=True, weight_function=len_of_longest_ss)
-            sequences_to_fix  = list(map(lambda edge : safe_seqs[longest_safe_sequence[edge]] , edge_antichain))
-
-            time_safety   = time.time()
-
-            time_lp_start = time.time()
-            w_seqs        = ilp.robust(G, epsilon=EPSILON, timeout=TIMEOUT, threads=THREADS, vars_to_fix=sequences_to_fix, optimize=True)
-            time_lp_end   = time.time()
-            
-            end           = time.time()
-
-            t_rb_seqs_heur   = end-start
-            t_safe_seqs_heur = time_safety - start
-            t_ilp_seqs_heur  = time_lp_end-time_lp_start
-            solved_seqs_heur = True
-            fixed_vars_s     = sum(map(lambda sequence : len(sequence), sequences_to_fix))
-        
-        except utils.GRB_TimeOut as e:
-            logger.info("\t{}. Graph {} in dataset \'{}\' with fixing subsequence constraints.".format(e,G.id,input_file))
-            t_rb_seqs_heur = t_ilp_seqs_heur = 0
-            solved_seqs_heur                 = False
-            w_seqs                           = -1
-            fixed_vars_s = t_safe_seqs_heur  = 0
-        except utils.GRB_Infeasible as e:
-            logger.info("\t{}. Graph {} in dataset \'{}\' with fixing subsequence constraints.".format(e,G.id,input_file))
-            t_rb_seqs_heur = t_ilp_seqs_heur = 0
-            solved_seqs_heur                 = False
-            w_seqs                           = -1
-            fixed_vars_s = t_safe_seqs_heur  = 0
-        logger.info("\tfixing safe sequences: {}, {} , {}, {}, {}, {}".format(solved_seqs_heur, t_rb_seqs_heur, t_safe_seqs_heur, t_ilp_seqs_heur, fixed_vars_s, w_seqs) )
-
-
-        f.write("solved default              : {}\n".format(solved_default              ))
-        f.write("total time default          : {}\n".format('%.6f' % t_rb_default       ))
-        f.write("solved sequences heur       : {}\n".format(solved_seqs_heur            ))
-        f.write("total time sequences heur   : {}\n".format('%.6f' % t_rb_seqs_heur     ))
-        f.write("preprocess sequences heur   : {}\n".format('%.6f' % t_safe_seqs_heur   ))
-        f.write("ilp time seqs heur          : {}\n".format('%.6f' % t_ilp_seqs_heur    ))
-        f.write("fixed vars seqs             : {}\n".format(fixed_vars_s                ))
-        f.write("final width default         : {}\n".format(w_van                       ))
-        f.write("final width sequences       : {}\n".format(w_seqs                      ))
+    f.f.write("#Winners\n") #after the last checkpoint, so a resumed run writes it again
+    for name in PORTFOLIO:
+        f.f.write("{:<28}: {}\n".format("wins " + name, wins.get(name, 0)))
+    logger.info("Portfolio winners: {}".format(wins))
 
     f.close()
     return
 
 
-def skeleton():
-    pass
+def safety_line(graph_raw, algorithm) -> tuple:
+    #(line, arcs) of a graph for the safety-only mode: its id followed by its safe sequences separated by ';', each given by the ids of its arcs
+    #separated by ',', where the arcs are numbered from 0 in input order and the arcs from the source and to the sink added by utils.read_graph are
+    #left out. The widths are not computed, so this mode loads neither networkx nor any solver
+    G     = utils.read_graph(graph_raw, width=False)
+    arcs  = len(graph_raw)-2
+    if arcs <= 0:
+        return "{}\t\n".format(G.id), 0
+    ids       = { arc : i for i,arc in enumerate(G.edge_list[:arcs]) }
+    safe_seqs = SAFETY[algorithm](G)
+    sequences = map(lambda safe_seq : ",".join( str(ids[arc]) for arc in safe_seq if arc in ids ), safe_seqs)
+    return "{}\t{}\n".format(G.id, ";".join(filter(None, sequences))), arcs
+
+
+def safety_lines(chunk, algorithm) -> tuple:
+    #(lines, arcs) of a chunk of graphs, which are sent to the processes together to save on the communication
+    lines = list(map(lambda graph_raw : safety_line(graph_raw, algorithm), chunk))
+    return "".join(map(lambda line : line[0], lines)), sum(map(lambda line : line[1], lines))
+
+
+def demo_safety():
+    #Mode 3: streams the graphs of the input file through a pool of processes computing their maximal safe sequences with ALGORITHM, without any ILP,
+    #and writes one line per graph (see safety_line) in input order. The graphs are sent to the processes in chunks of 64 input lines or more, and at most
+    #a few chunks per process are read ahead, so the memory does not grow with the input
+    path    = "SS_" + output_file + "_final.out"
+    cores   = CORES if CORES != None else os.cpu_count()
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+    graphs  = 0
+    arcs    = 0
+    start   = time.perf_counter()
+    with open(input_file, "r") as f, open(path, "w") as out, concurrent.futures.ProcessPoolExecutor(max_workers=cores, mp_context=context) as executor:
+        out.write("#id\tsafe sequences ({}) of arc ids, numbered from 0 in input order\n".format(ALGORITHM))
+        pending = collections.deque()
+        chunk   = []
+        for graph_raw in itertools.chain(utils.raw_graphs(f), [None]):
+            if graph_raw != None:
+                chunk.append(graph_raw)
+                if sum(map(len, chunk)) < 64:
+                    continue
+            if len(chunk) > 0:
+                pending.append(executor.submit(safety_lines, chunk, ALGORITHM))
+                graphs += len(chunk)
+                chunk   = []
+            while len(pending) > 0 and (graph_raw == None or len(pending) >= 4*cores or pending[0].done()):
+                lines, m = pending.popleft().result()
+                out.write(lines)
+                arcs    += m
+    seconds = time.perf_counter()-start
+    print("Safe sequences of {} graphs with {} arcs in {:.3f} seconds: {:.1f} graphs/s, {:.1f} arcs/s, written to {}".format(graphs, arcs, seconds, graphs/seconds, arcs/seconds, path))
+    logger.info("Safe sequences of {} graphs with {} arcs in {:.3f} seconds on {} cores".format(graphs, arcs, seconds, cores))
 
 def main():
     
     global input_file
     global output_file
     global log_file
+    global dt_day
+    global dt_time
     global THREADS
     global EPSILON
     global TIMEOUT
     global VERBOSE
     global MODE
+    global TIGHT
+    global SYMMETRY
+    global SOLVER
+    global SEARCH
+    global WORKERS
+    global UNITIGS
+    global IMPLIED
+    global BATCH
+    global CACHE
+    global TIMELINE
+    global PORTFOLIO
+    global CORES
+    global RESUME
+    global MODES
+    global STAGES
+    global FORMAT
+    global BUDGET
+    global ALGORITHM
 
     parser = argparse.ArgumentParser(description='Process inputs.')
 
@@ -386,16 +702,67 @@ def main():
     parser.add_argument('-c', '--clear'  , action='store_true'       , help='Enable clear mode'                                                             )
     parser.add_argument('-v', '--verbose', action='store_true'       , help='Enable verbose mode'                                                           )
     parser.add_argument('-m', '--mode'   , choices=['0','1','2','3'] , help='Optimization mode'                                                             )
+    parser.add_argument('-b', '--tight-bounds', action='store_true'  , help='Use per-arc and per-path big-M bounds derived from the flow values'             )
+    parser.add_argument('-s', '--symmetry', choices=['weights','source'], help='Break the symmetries among the paths not fixed to safe sequences'            )
+    parser.add_argument('-l', '--solver'  , choices=list(backends.BACKENDS), default='gurobi', help='MILP solver backend (default: gurobi)'                 )
+    parser.add_argument('-k', '--search'  , choices=['linear','galloping','greedy','speculative'], default='linear', help='Search strategy for the number of paths in mode 2 (default: linear)')
+    parser.add_argument('-p', '--workers' , type=int, default=2      , help='Number of values of k solved in parallel by the speculative search, sharing the threads (default: 2)')
+    parser.add_argument('-u', '--unitigs' , action='store_true'       , help='Encode the graph with every unitig contracted into a single arc'                )
+    parser.add_argument('-a', '--implied' , choices=['constraints','lazy'], help='Add the safe sequences not fixed to a path as subpath constraints, encoded up front or lazily')
+    parser.add_argument('-x', '--batch'   , type=int, nargs=2, metavar=('ARCS','WIDTH'), help='In modes 0 and 1, solve the vanilla ILPs of the graphs with at most ARCS arcs and width at most WIDTH in batches')
+    parser.add_argument('-d', '--cache'   , metavar='DIR'           , help='Reuse the widths, safe sequences and ILP results stored in DIR for isomorphic graphs, and store the new ones')
+    parser.add_argument('-T', '--timeline', action='store_true'      , help='Record the incumbent, best bound, gap and explored nodes during every solve, and the time to the first incumbent')
+    parser.add_argument('-P', '--portfolio', nargs='+', choices=ilp.PORTFOLIO, help='In modes 0, 1 and 2, race these configurations in parallel processes and keep the first proven optimum')
+    parser.add_argument('-j', '--cores'   , type=int                 , help='Solve the graphs in parallel processes sharing CORES cores, each solve with 1 to THREADS threads depending on the size of the graph')
+    parser.add_argument('-o', '--output'  , help='Name of the results file, in place of the input file name and the time of the run')
+    parser.add_argument('-r', '--resume'  , action='store_true'       , help='Continue the results file of the last run on the same input (or the one named by -o) after its last finished graph')
+    parser.add_argument('--modes'         , type=lambda s : s.split(','), help='Comma-separated modes among 0, 1 and 2 run in a single pass, sharing the parsing and the safe sequences of every graph')
+    parser.add_argument('-S', '--stages'  , choices=['time','memory'], help='Write the nanoseconds spent in every stage of every graph and mode (and with memory, their peak traced and resident memory) as JSON lines')
+    parser.add_argument('-F', '--format'  , choices=['jsonl','csv']  , help='Also write the results as one row per graph and mode, in JSON Lines or CSV')
+    parser.add_argument('-B', '--budget'  , type=float               , help='Total wall-clock seconds for the graphs, solved from the easiest predicted one with adaptive timeouts of at most TIMEOUT, and again at the end if not solved')
+    parser.add_argument('-A', '--algorithm', choices=list(SAFETY), default='dominators', help='In mode 3, algorithm computing the maximal safe sequences (default: dominators)')
+    parser.add_argument('--cache-size'    , type=int, default=1024  , help='Size in MB above which the least recently used cache entries are evicted (default: 1024)')
 
     args = parser.parse_args()
+    if args.modes != None and not set(args.modes) <= set(DEMOS):
+        parser.error("--modes takes modes among 0, 1 and 2")
+    if args.modes != None and args.portfolio != None:
+        parser.error("--modes cannot be combined with --portfolio")
+    if args.format != None and args.portfolio != None:
+        parser.error("--format cannot be combined with --portfolio, whose results have no rows")
+
+    random.seed(73)
+    current_time = datetime.now()
+    dt_day       = current_time.strftime("%d-%m")
+    dt_time      = current_time.strftime("%H-%M-%S")
+    log_file     = "log_{}_{}.out".format(dt_day,dt_time)
+    configure_logging(log_file)
 
     input_file  = args.input
-    output_file = '{}_{}_{}'.format(input_file.replace("/","_"),dt_day,dt_time)
+    output_file = args.output if args.output != None else '{}_{}_{}'.format(input_file.replace("/","_"),dt_day,dt_time)
     THREADS     = args.threads
     TIMEOUT     = args.timeout
     EPSILON     = args.epsilon
     VERBOSE     = args.verbose
     MODE        = args.mode
+    TIGHT       = args.tight_bounds
+    SYMMETRY    = args.symmetry
+    SOLVER      = args.solver
+    SEARCH      = args.search
+    WORKERS     = args.workers
+    UNITIGS     = args.unitigs
+    IMPLIED     = args.implied
+    BATCH       = args.batch
+    TIMELINE    = args.timeline
+    PORTFOLIO   = args.portfolio
+    CORES       = args.cores
+    RESUME      = args.resume
+    STAGES      = args.stages
+    FORMAT      = args.format
+    BUDGET      = args.budget
+    ALGORITHM   = args.algorithm
+    MODES       = list(dict.fromkeys(args.modes)) if args.modes != None else [MODE]
+    CACHE       = cache.Result_Cache(args.cache, args.cache_size << 20) if args.cache != None else None
 
     print(f"Input file : {input_file}")
     print(f"Num threads: {THREADS}")
@@ -403,19 +770,39 @@ def main():
     print(f"Timeout    : {TIMEOUT} seconds")
     print(f"Verbose    : {VERBOSE}")
     print(f"Mode       : {MODE}")
+    print(f"Modes      : {args.modes}")
+    print(f"Tight bound: {TIGHT}")
+    print(f"Symmetry   : {SYMMETRY}")
+    print(f"Solver     : {SOLVER}")
+    print(f"k search   : {SEARCH}")
+    print(f"Unitigs    : {UNITIGS}")
+    print(f"Implied    : {IMPLIED}")
+    print(f"Batch      : {BATCH}")
+    print(f"Cache      : {args.cache}")
+    print(f"Timeline   : {TIMELINE}")
+    print(f"Portfolio  : {PORTFOLIO}")
+    print(f"Cores      : {CORES}")
+    print(f"Resume     : {RESUME}")
+    print(f"Stages     : {STAGES}")
+    print(f"Format     : {FORMAT}")
+    print(f"Budget     : {BUDGET}")
+    print(f"Algorithm  : {ALGORITHM}")
+    if SEARCH == 'speculative':
+        print(f"Workers    : {WORKERS}")
     print(f"Clear      : {args.clear}")
 
-    if MODE == '0':
-        demo_RB()
-    elif MODE == '1':
-        demo_LQ()
-    elif MODE == '2':
-        demo_optimize_RB()
+    if PORTFOLIO != None and MODE in ['0','1','2']:
+        demo_portfolio()
+    elif all(map(lambda mode : mode in DEMOS, MODES)):
+        demo_modes()
     elif MODE== '3':
-        skeleton()
+        demo_safety()
     else:
         print("ERROR: bad mode to execute - must be 0 (for Robust) and 1 (for LeastSquares).")
 
+    if CACHE != None:
+        logger.info("Cache hits: {}, misses: {}".format(CACHE.hits, CACHE.misses))
+
     #Cleaner
     if args.clear:
         if os.path.exists(log_file):
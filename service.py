@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+import collections
+import concurrent.futures
+import socketserver
+import http.server
+import urllib.parse
+import safety
+import backends
+import ilp
+import cache
+import utils
+
+logger = logging.getLogger(__name__)
+
+SAFETY         = { "dominators" : lambda G : safety.maximal_safe_sequences_via_dominators(G, set(G.edge_list)),
+                   "maximal"    : lambda G : safety.maximal_safe_sequences(G, G.edge_list) }
+FORMULATIONS   = { "robust" : ilp.robust, "leastsquares" : ilp.leastsquares }
+#the speculative search is left out as every solve would spawn processes of its own, each importing the modules and starting a solver environment,
+#outside the warm threads of the pool and the bound of -j
+STRATEGIES     = ['linear','galloping','greedy']
+
+#query parameters of /decompose, with their types and defaults
+DECOMPOSE      = { "formulation" : (str  , "robust"    ),
+                   "safe"        : (int  , 1           ),
+                   "optimize"    : (int  , 0           ),
+                   "algorithm"   : (str  , "dominators"),
+                   "timeout"     : (int  , 300         ),
+                   "threads"     : (int  , 1           ),
+                   "epsilon"     : (float, 0.25        ),
+                   "solver"      : (str  , "gurobi"    ),
+                   "strategy"    : (str  , "linear"    ) }
+
+
+class Bad_Request(Exception):
+    pass
+
+
+def vertex(G, v) -> int:
+    #the id of v in the input, where the source and the sink added by utils.read_graph are -1 and n
+    return v-1
+
+
+def arcs(G, sequences) -> list:
+    return [ [ [vertex(G,u), vertex(G,v)] for (u,v) in sequence ] for sequence in sequences ]
+
+
+def query(parameters, types) -> dict:
+    #the values of the query parameters, with the defaults of the missing ones
+    values = dict()
+    for name,(kind,default) in types.items():
+        try:
+            values[name] = kind(parameters[name][-1]) if name in parameters else default
+        except ValueError:
+            raise Bad_Request("invalid value of {}: {}".format(name, parameters[name][-1]))
+    return values
+
+
+class Solve_Service:
+    #Computes the safe sequences and decompositions of the graphs posted to the server. The modules, the solver environments (one per solve thread,
+    #see backends.Gurobi_Backend.environment) and the caches stay loaded between requests, and at most jobs graphs are parsed or computed at once, on a
+    #fixed pool of threads whose environments are started when the service starts, while the threads of the requests only wait for them. The results of the last memo_size graphs are kept in memory, and with
+    #a cache directory, the widths, safe sequences and ILP results are shared with the runs of main.py on the same directory
+
+    def __init__(self, jobs, directory=None, max_bytes=None, memo_size=1024):
+        self.jobs      = jobs
+        self.cache     = cache.Result_Cache(directory, max_bytes) if directory != None else None
+        self.memo      = collections.OrderedDict()
+        self.memo_size = memo_size
+        self.lock      = threading.Lock()
+        self.served    = 0
+        self.started   = time.time()
+        self.pool      = concurrent.futures.ThreadPoolExecutor(max_workers=jobs, initializer=self.warm)
+        concurrent.futures.wait([ self.pool.submit(lambda : None) for _ in range(jobs) ]) #starts the threads
+
+    @staticmethod
+    def warm():
+        try:
+            backends.warm("gurobi")
+        except Exception as e: #no Gurobi license, HiGHS can still be used
+            logger.warning("Could not start a Gurobi environment: {}".format(e))
+
+    def memoized(self, key, compute):
+        with self.lock:
+            if key in self.memo:
+                self.memo.move_to_end(key)
+                return self.memo[key]
+        value = compute()
+        with self.lock:
+            self.memo[key] = value
+            while len(self.memo) > self.memo_size:
+                self.memo.popitem(last=False)
+        return value
+
+    def key(self, G, action, parameters) -> tuple:
+        return (action, parameters, G.n, tuple(sorted(G.flow.items())))
+
+    def graphs(self, body) -> list:
+        #the lines of every graph of the body, which are parsed by the pool (see parse), as the request threads of the server are not bounded
+        lines = body.decode().splitlines(keepends=True)
+        lines = list(filter(lambda line : line.strip() != "", lines))
+        if len(lines) == 0 or not lines[0].startswith("#"):
+            raise Bad_Request("expected graphs in the #Graph format")
+        return list(utils.raw_graphs(lines))
+
+    def parse(self, graph_raw):
+        try:
+            return utils.read_graph(graph_raw, self.cache)
+        except (ValueError, IndexError) as e:
+            raise Bad_Request("malformed graph {}: {}".format(graph_raw[0][7:].strip(), e))
+
+    def safe_sequences(self, G, algorithm) -> tuple:
+        #(safe sequences, sequences to fix, seconds) of G, from the memo, the cache or computed
+        def compute():
+            if self.cache != None:
+                hit = self.cache.get_safety(G, algorithm)
+                if hit != None:
+                    return hit
+            start            = time.perf_counter()
+            safe_seqs        = SAFETY[algorithm](G)
+            sequences_to_fix = utils.sequences_to_fix(G, safe_seqs)
+            seconds          = time.perf_counter()-start
+            if self.cache != None:
+                self.cache.put_safety(G, algorithm, safe_seqs, sequences_to_fix, seconds)
+            return safe_seqs, sequences_to_fix, seconds
+        return self.memoized(self.key(G, "safety", algorithm), compute)
+
+    def safety(self, G, algorithm) -> dict:
+        start                          = time.perf_counter()
+        safe_seqs, sequences_to_fix, _ = self.safe_sequences(G, algorithm)
+        return { "id" : G.id, "n" : G.n-2, "m" : G.m, "w" : G.w, "safe_sequences" : arcs(G, safe_seqs), "sequences_to_fix" : arcs(G, sequences_to_fix),
+                 "seconds" : time.perf_counter()-start }
+
+    def decompose(self, G, options) -> dict:
+        start = time.perf_counter()
+        if len(G.edge_list) == 0 or utils.is_0_flow_everywhere(G):
+            return { "id" : G.id, "error" : "the graph has no flow to decompose" }
+        fixed      = self.safe_sequences(G, options["algorithm"])[1] if options["safe"] else []
+        parameters = tuple(sorted( (name,value) for name,value in options.items() if name != "threads" )) #as in main.ilp_parameters, the threads do not change the result
+        def solve():
+            result = self.cache.get_result(G, parameters, fixed) if self.cache != None else None
+            if result != None:
+                return result[0]
+            solved = time.perf_counter()
+            result = FORMULATIONS[options["formulation"]](G, options["epsilon"], options["timeout"], options["threads"], vars_to_fix=fixed,
+                                                          optimize=bool(options["optimize"]), backend=options["solver"], strategy=options["strategy"])
+            if self.cache != None:
+                self.cache.put_result(G, parameters, fixed, result, time.perf_counter()-solved)
+            return result
+        try:
+            result = self.memoized(self.key(G, "ilp", parameters), solve)
+        except (utils.GRB_TimeOut, utils.GRB_Infeasible) as e:
+            return { "id" : G.id, "error" : str(e), "seconds" : time.perf_counter()-start }
+        except Exception as e: #a solver error, as a license or size limit, fails only this graph
+            logger.exception("Could not decompose graph {}".format(G.id))
+            return { "id" : G.id, "error" : "{}: {}".format(type(e).__name__, e), "seconds" : time.perf_counter()-start }
+        paths = []
+        for entry in (result.solution if result.solution != None else []):
+            weight, path = entry[0], entry[-1]
+            paths.append({ "weight" : weight, "slack" : entry[1] if len(entry) == 3 else None, "path" : [ vertex(G,v) for v in path ] })
+        return { "id" : G.id, "status" : result.status, "objective" : result.obj, "bound" : result.bound, "gap" : result.gap, "k" : result.k,
+                 "fixed" : len(fixed), "paths" : paths, "seconds" : time.perf_counter()-start }
+
+    def handle(self, method, path, body):
+        #(HTTP status, JSON response) of a request
+        url        = urllib.parse.urlparse(path)
+        parameters = urllib.parse.parse_qs(url.query)
+        try:
+            if method == "GET" and url.path == "/status":
+                return 200, { "jobs" : self.jobs, "served" : self.served, "uptime" : time.time()-self.started, "memo" : len(self.memo),
+                              "cache_hits" : self.cache.hits if self.cache != None else None, "cache_misses" : self.cache.misses if self.cache != None else None }
+            if method == "POST" and url.path == "/safety":
+                algorithm = query(parameters, { "algorithm" : (str, "dominators") })["algorithm"]
+                if algorithm not in SAFETY:
+                    raise Bad_Request("unknown algorithm: {}".format(algorithm))
+                task = lambda G : self.safety(G, algorithm)
+            elif method == "POST" and url.path == "/decompose":
+                options = query(parameters, DECOMPOSE)
+                for name,choices in [("formulation", FORMULATIONS), ("algorithm", SAFETY), ("solver", backends.BACKENDS), ("strategy", STRATEGIES)]:
+                    if options[name] not in choices:
+                        raise Bad_Request("unknown {}: {}".format(name, options[name]))
+                if options["formulation"] == "leastsquares" and not backends.BACKENDS[options["solver"]].quadratic:
+                    raise Bad_Request("the {} solver does not support the quadratic objective of leastsquares".format(options["solver"]))
+                task = lambda G : self.decompose(G, options)
+            else:
+                return 404, { "error" : "unknown request {} {}".format(method, url.path) }
+            graphs  = self.graphs(body)
+            results = list(self.pool.map(lambda graph_raw : task(self.parse(graph_raw)), graphs))
+        except Bad_Request as e:
+            return 400, { "error" : str(e) }
+        except Exception as e: #still answer the client
+            logger.exception("{} {} failed".format(method, path))
+            return 500, { "error" : "{}: {}".format(type(e).__name__, e) }
+        with self.lock:
+            self.served += len(graphs)
+        logger.info("{} {}: {} graphs".format(method, path, len(graphs)))
+        return 200, { "graphs" : results }
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class Request_Handler(http.server.BaseHTTPRequestHandler):
+
+    service = None
+
+    def respond(self, method):
+        length       = int(self.headers.get("Content-Length", 0))
+        body         = self.rfile.read(length) if length > 0 else b""
+        status, data = self.service.handle(method, self.path, body)
+        payload      = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type"  , "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self.respond("GET")
+
+    def do_POST(self):
+        self.respond("POST")
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class Unix_Request_Handler(Request_Handler):
+
+    def address_string(self): #the client address of a Unix socket is empty
+        return "unix"
+
+
+class Unix_HTTP_Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Serve the safe sequences and flow decompositions of the graphs posted in the #Graph format.')
+
+    parser.add_argument('--host'          , default='127.0.0.1'     , help='Address of the HTTP server (default: 127.0.0.1)'                    )
+    parser.add_argument('--port'          , type=int, default=8765  , help='Port of the HTTP server (default: 8765)'                           )
+    parser.add_argument('--socket'        , metavar='PATH'          , help='Listen on the Unix socket PATH instead of HTTP over TCP'           )
+    parser.add_argument('-j', '--jobs'    , type=int, default=os.cpu_count(), help='Graphs computed at once, each solve on its own warm thread (default: number of cores)')
+    parser.add_argument('-d', '--cache'   , metavar='DIR'           , help='Reuse the widths, safe sequences and ILP results stored in DIR for isomorphic graphs, and store the new ones')
+    parser.add_argument('--cache-size'    , type=int, default=1024  , help='Size in MB above which the least recently used cache entries are evicted (default: 1024)')
+    parser.add_argument('--memo'          , type=int, default=1024  , help='Number of graphs whose results are kept in memory (default: 1024)'  )
+    parser.add_argument('-v', '--verbose' , action='store_true'     , help='Log every request on the standard error'                            )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s', datefmt='%H-%M-%S', level=logging.DEBUG if args.verbose else logging.INFO)
+
+    service                 = Solve_Service(args.jobs, args.cache, args.cache_size*1024*1024, args.memo)
+    Request_Handler.service = service
+    if args.socket != None:
+        server = Unix_HTTP_Server(args.socket, Unix_Request_Handler)
+        logger.info("Serving on the Unix socket {} with {} jobs".format(args.socket, args.jobs))
+    else:
+        server = http.server.ThreadingHTTPServer((args.host, args.port), Request_Handler)
+        logger.info("Serving on http://{}:{} with {} jobs".format(args.host, args.port, args.jobs))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if args.socket != None and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
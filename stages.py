@@ -0,0 +1,82 @@
+import contextlib
+import functools
+import resource
+import time
+import tracemalloc
+
+active = None #the Stage_Timer of the graph being processed, to which the stages of every module report
+
+
+class Stage_Timer:
+    #Accumulates the nanoseconds (perf_counter_ns) spent in every stage of the processing of a graph and, with memory=True, the peak of the Python
+    #allocations traced by tracemalloc during the stage and the maximum resident set size of the process at its end (which also covers the memory of
+    #the solvers). Nested stages are keyed by their path, e.g. "default/solve", and a stage entered again within itself, as an overriding method
+    #calling the one it overrides, is counted once
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.ns     = dict() #stage -> nanoseconds
+        self.peak   = dict() #stage -> bytes
+        self.rss    = dict() #stage -> kB
+        self.stack  = []     #[key, start ns, traced bytes at start, peak traced bytes] of the open stages
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if len(self.stack) > 0 and self.stack[-1][0].rsplit("/", 1)[-1] == name:
+            yield
+            return
+        key = name if len(self.stack) == 0 else self.stack[-1][0] + "/" + name
+        if self.memory:
+            current,peak = tracemalloc.get_traced_memory()
+            for frame in self.stack: #the peak since the last reset belongs to the open stages
+                frame[3] = max(frame[3], peak)
+            tracemalloc.reset_peak()
+        else:
+            current = 0
+        frame = [key, time.perf_counter_ns(), current, current]
+        self.stack.append(frame)
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            self.ns[key] = self.ns.get(key, 0) + time.perf_counter_ns() - frame[1]
+            if self.memory:
+                frame[3]       = max(frame[3], tracemalloc.get_traced_memory()[1])
+                self.peak[key] = max(self.peak.get(key, 0), frame[3] - frame[2])
+                self.rss[key]  = max(self.rss.get(key, 0), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+                if len(self.stack) > 0:
+                    self.stack[-1][3] = max(self.stack[-1][3], frame[3])
+
+    def record(self) -> dict:
+        if self.memory:
+            return { "ns" : dict(self.ns), "peak_bytes" : dict(self.peak), "max_rss_kb" : dict(self.rss) }
+        return { "ns" : dict(self.ns) }
+
+
+def stage(name):
+    #context of a stage of the active timer, if any
+    return active.stage(name) if active != None else contextlib.nullcontext()
+
+
+def timed(name):
+    #decorator timing every call of a function as a stage of the active timer
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextlib.contextmanager
+def activate(timer):
+    global active
+    previous = active
+    active   = timer
+    try:
+        yield timer
+    finally:
+        active = previous
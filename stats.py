@@ -1,113 +1,120 @@
-from collections import defaultdict
 import argparse
+import json
+import csv
 import re
+import numpy as np
 
 
-def parse_input_file(filename):
-    data = defaultdict(list)
-    current_graph = None
+#the keys of the lines of the results blocks written by main.py that are aggregated, and their columns in the rows written with -F
+TEXT_KEYS = { 'solved default'            : 'solved_default',
+              'total time default'        : 'time_default',
+              'solved sequences heur'     : 'solved_sequences',
+              'total time sequences heur' : 'time_sequences',
+              'preprocess sequences heur' : 'preprocess_sequences',
+              'ilp time seqs heur'        : 'ilp_time_sequences',
+              'fixed vars seqs'           : 'fixed_vars' }
+
+
+def parse_value(value):
+    if value in ['True', 'False']:
+        return value == 'True'
+    if value in ['', 'None']:
+        return None
+    return float(value)
 
+
+def parse_input_file(filename):
+    #the rows of a results file of main.py, one per graph: the results blocks of the text file (whose graph ids are any string), or the rows written
+    #with -F to a .jsonl or .csv file
+    if filename.endswith('.jsonl'):
+        with open(filename) as file:
+            return [ json.loads(line) for line in file if line.strip() != '' ]
+    if filename.endswith('.csv'):
+        with open(filename, newline='') as file:
+            return [ { key : value if key in ['graph','mode'] else parse_value(value) for key,value in row.items() } for row in csv.DictReader(file) ]
+
+    rows = []
+    mode = None
     with open(filename, 'r') as file:
         for line in file:
             line = line.strip()
 
             if line.startswith('#Graph'):
-                current_graph = int(line.split()[1])
-
-            elif current_graph is not None:
-                if re.match(r'\d+,\s*\d+,\s*\d+', line):
-                    n, m, w = map(int, line.split(','))
-
-                    data[current_graph] = {
-                        'n': n, 'm': m, 'w': w,
-                        'solved default': None, 'total time default': None,
-                        'solved sequences heur': None, 'total time sequences heur': None,
-                        'preprocess sequences heur': None, 'ilp time seqs heur': None,
-                        'fixed vars seqs': None,
-                    }
-                
-                elif 'solved' in line or 'time' in line or 'preprocess' in line or 'fixed' in line:
-
-                    key, value = line.split(':')
-                    key = key.strip()
-                    value = value.strip()
-
-                    if value in ['True', 'False']:
-                        value = value == 'True'
-                    else:
-                        value = float(value)
-
-                    if key in data[current_graph]:
-                        data[current_graph][key] = value
-
-    return data
-
-
-
-def group_by_width(parsed_data):
-
-    # Flexible width ranges
-    width_ranges = {
-        "1-3": (1, 3),
-        "4-6": (4, 6),
-        "7-9": (7, 9),
-        "10+": (10, 10000)
-    }
-    
-    grouped_data = {key: {
-        'graphs': 0, 'edges': [], 'widths': [], 'preprocess sequences heur': [],
-        'total time default': [], 'total time sequences heur': [],
-        'ilp time seqs heur' : [], 
-        'solved default': 0, 'solved sequences heur': 0,
-        'speedup_seqs': [], 'fixed vars seqs': [],
-        'total time default solo': [], 'total time sequences heur solo': [],
-        'graphs_common': 0,
-    } for key in width_ranges}
-    for graph, info in parsed_data.items():
-        n,m,w = info['n'],info['m'],info['w']
-        for range_label, (low, high) in width_ranges.items():
-            if low <= w <= high:
-                group = grouped_data[range_label]
-                group['graphs'] += 1
-                group['edges'].append(m)
-                group['widths'].append(w)
-
-                # Store ILP times in instances solved in all configurations
-                if info['solved default'] and info['solved sequences heur']:
-                    group['total time default'].append(info['total time default'])
-
-                    group['total time sequences heur'].append(info['total time sequences heur'])
-                    group['ilp time seqs heur'].append(info['ilp time seqs heur'])
-
-                    group['graphs_common'] += 1 # Find intersection of solved instances in each safety setting
-
-                # Preprocessing time, number of instances solved, total time for every safety setting, fixed variables
-                if info['solved default']:
-                    group['solved default'] += 1
-                    group['total time default solo'].append(info['total time default'])
-                    
-                if info['solved sequences heur']:
-                    group['preprocess sequences heur'].append(info['preprocess sequences heur'])
-                    group['solved sequences heur'] += 1
-                    group['total time sequences heur solo'].append(info['total time sequences heur'])
-                    group['fixed vars seqs'].append(info['fixed vars seqs']/(w*m))
-
-                if info['solved default'] and info['solved sequences heur']:
-                    assert(info['total time sequences heur'] > 0 and info['ilp time seqs heur'] > 0)
-                    #if info['total time sequences heur'] > 0 and info['ilp time seqs heur'] > 0:  # Ensure we avoid division by zero
-                    speedup_seqs              = info['total time default'] / info['ilp time seqs heur']
-                    speedup_seqs_with_preproc = info['total time default'] / info['total time sequences heur']
-                    assert( abs(info['total time sequences heur'] - (info['ilp time seqs heur'] + info['preprocess sequences heur'])) < 0.1)
-                    group['speedup_seqs'].append((speedup_seqs, speedup_seqs_with_preproc))
-                
-                if not info['solved default'] and info['solved sequences heur']:
-                    speedup_seqs              = 300 / info['ilp time seqs heur']
-                    speedup_seqs_with_preproc = 300 / info['total time sequences heur']
-                    group['speedup_seqs'].append((speedup_seqs, speedup_seqs_with_preproc))
-                if info['solved default'] and not info['solved sequences heur']:
-                    speedup_seqs              = info['total time default'] / (300 + info['total time default']) 
-                    speedup_seqs_with_preproc = info['total time default'] / (300 + info['total time default'])
-                    group['speedup_seqs'].append((speedup_seqs, speedup_seqs_with_preproc))
+                rows.append({ 'graph': line[7:], 'mode': mode })
+
+            elif len(rows) == 0: #the header of the file
+                header = re.search(r'Mode:(\w+)', line)
+                mode   = header.group(1) if header else mode
+
+            elif re.fullmatch(r'\d+,\s*\d+,\s*\d+', line):
+                rows[-1]['n'], rows[-1]['m'], rows[-1]['w'] = map(int, line.split(','))
+
+            elif ':' in line:
+                key, value = map(str.strip, line.split(':', 1))
+                if key in TEXT_KEYS:
+                    rows[-1][TEXT_KEYS[key]] = parse_value(value)
+
+    return rows
+
+
+def load(filenames, mode=None):
+    #the rows of all the files (of the given mode, if any) as NumPy columns, where missing values are NaN, and missing solved flags False
+    rows    = [ row for filename in filenames for row in parse_input_file(filename) if mode == None or str(row.get('mode')) == mode ]
+    columns = { key : np.array([ row.get(key) for row in rows ], dtype=object) for key in ['graph', 'mode'] }
+    for key in ['n', 'm', 'w', 'time_default', 'time_sequences', 'preprocess_sequences', 'ilp_time_sequences', 'fixed_vars']:
+        columns[key] = np.array([ row.get(key) if row.get(key) != None else np.nan for row in rows ], dtype=float)
+    for key in ['solved_default', 'solved_sequences']:
+        columns[key] = np.array([ bool(row.get(key)) for row in rows ], dtype=bool)
+    return columns
+
+
+def width_ranges(bounds):
+    #the labels of the width ranges starting at the given increasing bounds, the last one unbounded: 1,4,7,10 gives 1-3, 4-6, 7-9 and 10+
+    return [ "{}-{}".format(low, high-1) if high-1 > low else str(low) for low,high in zip(bounds, bounds[1:]) ] + [ "{}+".format(bounds[-1]) ]
+
+
+def group_by_width(data, bounds, timeout):
+    #the columns of the rows in every width range, where the speedup of a graph solved in only one setting counts the unsolved ILP as timeout seconds
+
+    w, m          = data['w'], data['m']
+    solved_d      = data['solved_default']
+    solved_s      = data['solved_sequences']
+    time_d        = data['time_default']
+    time_s        = data['time_sequences']
+    ilp_s         = data['ilp_time_sequences']
+    preprocess_s  = data['preprocess_sequences']
+    both          = solved_d & solved_s
+
+    assert(np.all(time_s[both] > 0) and np.all(ilp_s[both] > 0))
+    assert(np.all(np.abs(time_s[both] - (ilp_s[both] + preprocess_s[both])) < 0.1))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speedup_seqs              = np.where(both, time_d / ilp_s , np.where(solved_s, timeout / ilp_s , time_d / (timeout + time_d)))
+        speedup_seqs_with_preproc = np.where(both, time_d / time_s, np.where(solved_s, timeout / time_s, time_d / (timeout + time_d)))
+    has_speedup   = solved_d | solved_s
+
+    bucket        = np.digitize(w, bounds) - 1 #-1 below the first bound
+    grouped_data  = {}
+    for index, range_label in enumerate(width_ranges(bounds)):
+        B = bucket == index
+        grouped_data[range_label] = {
+            'graphs'                        : int(B.sum()),
+            'edges'                         : m[B],
+            'widths'                        : w[B],
+            # ILP times in instances solved in all configurations
+            'graphs_common'                 : int((B & both).sum()),
+            'total time default'            : time_d[B & both],
+            'total time sequences heur'     : time_s[B & both],
+            'ilp time seqs heur'            : ilp_s [B & both],
+            # Preprocessing time, number of instances solved, total time for every safety setting, fixed variables
+            'solved default'                : int((B & solved_d).sum()),
+            'total time default solo'       : time_d[B & solved_d],
+            'solved sequences heur'         : int((B & solved_s).sum()),
+            'preprocess sequences heur'     : preprocess_s[B & solved_s],
+            'total time sequences heur solo': time_s[B & solved_s],
+            'fixed vars seqs'               : (data['fixed_vars'] / (w * m))[B & solved_s],
+            'speedup_seqs'                  : np.stack([speedup_seqs[B & has_speedup], speedup_seqs_with_preproc[B & has_speedup]], axis=1),
+        }
 
     return grouped_data
 
@@ -128,13 +135,11 @@ def calculate_metrics(grouped_data):
         # Calculate ILP times
         assert(len(group['total time default']) == len(group['total time sequences heur']))
         if len(group['total time default'])>0:
-            results[width_range]['ilp_no_safety']  = sum(group['total time default'])  / len(group['total time default'])
-            results[width_range]['ilp_safe_seqs']  = sum(group['ilp time seqs heur'])  / len(group['total time default'])
+            results[width_range]['ilp_no_safety']  = group['total time default'].mean()
+            results[width_range]['ilp_safe_seqs']  = group['ilp time seqs heur'].mean()
 
         if len(group['speedup_seqs']) > 0:
-            speedup_seqs               = sum(pair[0] for pair in group['speedup_seqs']) / len(group['speedup_seqs'])
-            #speedup_seqs_with_preproc = sum(pair[1] for pair in group['speedup_seqs']) / len(group['speedup_seqs'])
-            results[width_range]['speedup_seqs'] = speedup_seqs
+            results[width_range]['speedup_seqs'] = group['speedup_seqs'][:,0].mean()
 
     return results
 
@@ -163,25 +168,24 @@ def calculate_solved(grouped_data):
 
         # Calculate averages for preprocessing times
         if group['graphs'] > 0:
-            results[width_range]['edges'] = sum(group['edges'])/group['graphs'],
+            results[width_range]['edges'] = group['edges'].mean()
             if len(group['preprocess sequences heur']) > 0:
-                results[width_range]['preprocess_seqs'] = (sum(group['preprocess sequences heur']) / len(group['preprocess sequences heur']))
-            results[width_range]['max_edges'] = max(group['edges'])
-            results[width_range]['max_width'] = max(group['edges'])
+                results[width_range]['preprocess_seqs'] = group['preprocess sequences heur'].mean()
+            results[width_range]['max_edges'] = int(group['edges'].max())
+            results[width_range]['max_width'] = int(group['widths'].max())
 
         # Compute average total times in every safety setting
         if group['solved default'] > 0:
-            results[width_range]['avg_time_default']    = sum(group['total time default solo']) / group['solved default']
+            results[width_range]['avg_time_default']    = group['total time default solo'].mean()
         if group['solved sequences heur'] > 0:
-            results[width_range]['avg_time_sequences']  = sum(group['total time sequences heur solo']) / group['solved sequences heur']
+            results[width_range]['avg_time_sequences']  = group['total time sequences heur solo'].mean()
 
         # Calculate average of fixed vars on solved instances
         if group['solved sequences heur'] > 0:
-            results[width_range]['fixed_seqs']  = 100 * sum(group['fixed vars seqs']) / group['solved sequences heur']  
+            results[width_range]['fixed_seqs']  = 100 * group['fixed vars seqs'].mean()
 
         if len(group['speedup_seqs']) > 0:
-            speedup_seqs               = sum(pair[0] for pair in group['speedup_seqs']) / len(group['speedup_seqs'])
-            results[width_range]['speedup_seqs'] = speedup_seqs
+            results[width_range]['speedup_seqs'] = group['speedup_seqs'][:,0].mean()
 
     return results
 
@@ -235,7 +239,7 @@ def generate_table2(results):
 
         speedup_seqs          = f"{metrics['speedup_seqs']:.1f}" if metrics['speedup_seqs'] != -1 else "-"
 
-        edges_info            = (f"{metrics['edges']}") + " (" + f"{metrics['max_edges']}" + ")" if metrics['edges'] != -1 else "-"
+        edges_info            = (f"{metrics['edges']:.1f}") + " (" + f"{metrics['max_edges']}" + ")" if metrics['edges'] != -1 else "-"
 
         latex_code += f"& {width_range} & {metrics['graphs']} & {edges_info} & {preprocess_seqs} & {fixed_sequences} & {solved_default_time} & {solved_sequences_time} & {speedup_seqs} \\\\\n"
     
@@ -252,14 +256,17 @@ def main():
 
     parser = argparse.ArgumentParser(description='Process inputs.')
 
-    parser.add_argument('-i', '--input'  , required=True, help='Input file path')
+    parser.add_argument('-i', '--input'  , required=True, nargs='+', help='Results files of main.py: text files, or the .jsonl or .csv rows written with -F')
+    parser.add_argument('-o', '--output' , help='Prefix of the LaTeX tables (default: the first input file)')
+    parser.add_argument('-m', '--mode'   , help='Aggregate only the rows of this mode')
+    parser.add_argument('-w', '--widths' , default='1,4,7,10', help='Comma-separated increasing widths starting the width ranges, the last one unbounded (default: 1,4,7,10)')
+    parser.add_argument('-g', '--timeout', type=float, default=300, help='Timeout of the runs in seconds, counted as the time of the unsolved ILPs in the speedups (default: 300)')
 
     args = parser.parse_args()
 
-    filename    = args.input
-    parsed_data = parse_input_file(filename)
-
-    grouped_data = group_by_width(parsed_data)
+    filename     = args.output if args.output != None else args.input[0]
+    data         = load(args.input, args.mode)
+    grouped_data = group_by_width(data, list(map(int, args.widths.split(','))), args.timeout)
 
     '''
     The variables `results1'' and ``latex_code1'' shoudl be ignored.
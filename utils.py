@@ -1,16 +1,16 @@
 from itertools import count
-from graphviz  import Digraph
-import networkx as nx
+from collections import defaultdict
 import graph
+import stages
 import random
 import logging
-import numpy as np
 
 logger = logging.getLogger(__name__)
 inf    = 1 << 32
 
-def read_graph(graph_raw):
-    #Input format is: ['#Graph id\n', 'n\n', 'u_1 v_1 w_1\n', ..., 'u_k v_k w_k\n']
+def read_graph(graph_raw, cache=None, width=True):
+    #Input format is: ['#Graph id\n', 'n\n', 'u_1 v_1 w_1\n', ..., 'u_k v_k w_k\n']. With width=False, G.w is left None, which spares the minimum
+    #flow (and loading networkx) to the users needing only the safe sequences
     id = graph_raw[0][7:]
     id = id[:len(id)-1]
     n  = int(graph_raw[1])
@@ -32,30 +32,57 @@ def read_graph(graph_raw):
     for t in sinks:
         G.add_edge(       t, G.sink, G.inflow(t))
 
-    G.w = max_edge_antichain(G)
+    G.w = cache.get_width(G) if cache != None else None
+    if G.w == None and width:
+        with stages.stage("width"):
+            G.w = max_edge_antichain(G)
+        if cache != None:
+            cache.put_width(G, G.w)
 
     return G
 
 
-def read_graphs(filename):
+def read_graphs(filename, cache=None, skip=(), timed=False, memory=False, width=True):
+    #the graphs of the file, see parse_graphs
     f      = open(filename, "r")
     lines  = f.readlines()
     f.close()
+    return parse_graphs(lines, cache, skip, timed, memory, width)
+
+
+def parse_graphs(lines, cache=None, skip=(), timed=False, memory=False, width=True):
+    #the graphs of the lines of an input file. cache is an optional cache.Result_Cache, from which the widths of the graphs already seen are taken, and
+    #the graphs whose ids are in skip are not read at all. With timed=True, every graph gets a stages.Stage_Timer G.timer (tracking memory too with
+    #memory=True) holding its parse stage
     graphs = []
 
-    #Assume: every file contains at least one graph
-    i,j = 0,1 
-    while True:
-        if lines[j].startswith("#"):
-            graphs.append(read_graph(lines[i:j]))
-            i = j
-        j += 1
-        if (j==len(lines)):
-            graphs.append(read_graph(lines[i:j]))
-            break
+    def parse(graph_raw):
+        if not timed:
+            return read_graph(graph_raw, cache, width)
+        timer = stages.Stage_Timer(memory)
+        with stages.activate(timer), timer.stage("parse"):
+            G = read_graph(graph_raw, cache, width)
+        G.timer = timer
+        return G
+
+    for graph_raw in raw_graphs(lines):
+        if graph_raw[0][7:-1] not in skip:
+            graphs.append(parse(graph_raw))
 
     return graphs
-    
+
+
+def raw_graphs(lines):
+    #the lines of every graph, starting with its #Graph header, which are read lazily when lines is an open file
+    graph_raw = []
+    for line in lines:
+        if line.startswith("#") and len(graph_raw) > 0:
+            yield graph_raw
+            graph_raw = []
+        graph_raw.append(line)
+    if len(graph_raw) > 0:
+        yield graph_raw
+
 
 def ER_st_DAG(n:int, p:float) -> graph.st_DAG :
     G = graph.st_DAG(n+2, 0, n+1, "ER_"+str(p))
@@ -83,6 +110,7 @@ def is_0_flow_everywhere(G : graph.st_DAG) -> bool:
 
 
 def visualize(G : graph.st_DAG, weighted_paths=[], safe_sequences=[], tag = ''):
+    from graphviz import Digraph #the heavy dependencies are imported on first use, so that the users of the safe sequences alone start fast
     dot = Digraph(format='pdf')
     dot.graph_attr['rankdir'] = 'LR'        # Display the graph in landscape mode
     dot.node_attr['shape']    = 'rectangle' # Rectangle nodes
@@ -120,6 +148,7 @@ def visualize(G : graph.st_DAG, weighted_paths=[], safe_sequences=[], tag = ''):
 
 
 def min_cost_flow(G, s, t):
+    import networkx as nx
     
     flowNetwork = nx.DiGraph()
     
@@ -161,6 +190,7 @@ def min_cost_flow(G, s, t):
 
 
 def max_edge_antichain(G_original : graph.st_DAG, get_antichain = False, weight_function = {}) -> list :
+    import networkx as nx
 
     G_nx       = nx.DiGraph()
     new_source = 0
@@ -225,18 +255,48 @@ def max_edge_antichain(G_original : graph.st_DAG, get_antichain = False, weight_
     return flowCost
 
 
+def sequences_to_fix(G : graph.st_DAG, safe_seqs : list) -> list:
+    #every arc is weighted by the length of its longest safe sequence, and the longest safe sequences of the arcs of a maximum weight edge antichain are returned
+    longest_safe_sequence = dict()
+    len_of_longest_ss     = defaultdict(lambda:0)
+    with stages.stage("coverage"):
+        for i in range(len(safe_seqs)):
+            safe_seq = safe_seqs[i]
+            length = len(safe_seq)
+            for edge in safe_seq:
+                if edge not in longest_safe_sequence:
+                    longest_safe_sequence[edge] = i
+                    len_of_longest_ss[edge]     = length
+                elif len(safe_seqs[longest_safe_sequence[edge]]) < length:
+                    longest_safe_sequence[edge] = i
+                    len_of_longest_ss[edge]     = length
+
+    with stages.stage("antichain"):
+        _, edge_antichain = max_edge_antichain(G, get_antichain=True, weight_function=len_of_longest_ss)
+    return list(map(lambda edge : safe_seqs[longest_safe_sequence[edge]] , edge_antichain))
+
+
+def sequences_to_imply(safe_seqs : list, fixed : list) -> list:
+    #the safe sequences not fixed to a path, each of which must still appear in some path of any decomposition, so they can be given to the ILP as
+    #subpath constraints
+    fixed = set(map(tuple, fixed))
+    return list(filter(lambda safe_seq : tuple(safe_seq) not in fixed, safe_seqs))
+
+
 class GRB_TimeOut(Exception):
-    def __init__(self, message:str):
-        super(GRB_TimeOut, self).__init__('TimeOut: ' + message)
+    #the prefix is added by __str__, so that the message survives pickling (as when sent back by the processes of ilp and jobs)
+    def __str__(self):
+        return 'TimeOut: ' + super(GRB_TimeOut, self).__str__()
 
 
 class GRB_Infeasible(Exception):
-    def __init__(self, message:str):
-        super(GRB_Infeasible, self).__init__('Infeasibility: ' + message)
+    def __str__(self):
+        return 'Infeasibility: ' + super(GRB_Infeasible, self).__str__()
 
 
 
 def metrics(G : graph.st_DAG):
+    import numpy as np
     flow_values = list(G.flow.values())
 
     average = np.mean(flow_values)